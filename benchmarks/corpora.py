@@ -0,0 +1,102 @@
+import random
+
+import harness
+from ColorPainter.sublime_css_colors import sublime_css_colors
+
+
+def hex_color(rnd):
+    n = rnd.choice((3, 4, 6, 6, 6, 8))
+    return "#" + "".join(rnd.choice("0123456789abcdefABCDEF") for _ in range(n))
+
+
+def function_color(rnd):
+    kind = rnd.choice(("rgb", "rgba", "hsl", "hsla"))
+    if kind.startswith("rgb"):
+        values = [str(rnd.randrange(256)) for _ in range(3)]
+    else:
+        values = [str(rnd.randrange(361)),
+                  "%d%%" % rnd.randrange(101), "%d%%" % rnd.randrange(101)]
+    if kind.endswith("a"):
+        values.append(rnd.choice(("0", "1", ".5", "0.25")))
+    return "%s(%s)" % (kind, ", ".join(values))
+
+
+def any_color(rnd):
+    f = rnd.choice((hex_color, hex_color, function_color))
+    return f(rnd) if rnd.random() < 0.8 else rnd.choice(sublime_css_colors)
+
+
+def css_lines(rnd):
+    properties = ("color", "background", "border-color", "fill", "stroke")
+    while True:
+        yield ".c%d {" % rnd.randrange(10000)
+        for _ in range(rnd.randint(1, 5)):
+            yield "    %s: %s;" % (rnd.choice(properties), any_color(rnd))
+        yield "}"
+        yield ""
+
+
+def code_lines(rnd):
+    # Source code with a color every few lines.
+    words = ("self", "value", "return", "index", "range", "items", "for",
+             "def", "if", "else", "data", "result", "None", "True", "key")
+    while True:
+        line = " ".join(rnd.choice(words) for _ in range(rnd.randint(2, 12)))
+        if rnd.random() < 0.1:
+            line += ' = "%s"' % any_color(rnd)
+        yield "    " * rnd.randint(0, 3) + line
+
+
+def minified_lines(rnd):
+    # A minified stylesheet: everything on one line.
+    rules = css_lines(rnd)
+    while True:
+        yield "".join(next(rules).strip() for _ in range(25000))
+
+
+def dense_lines(rnd):
+    # Like hex6.txt: nothing but colors.
+    while True:
+        yield " ".join(hex_color(rnd) for _ in range(8))
+
+
+kinds = {
+    "css": css_lines,
+    "code": code_lines,
+    "dense": dense_lines,
+    "minified": minified_lines,
+}
+
+# A big corpus repeats a block of this size, so that generating it does
+# not take longer than painting it.
+block_size = 1 << 20
+
+
+def generate(kind, size, seed=0):
+    rnd = random.Random("%s:%d" % (kind, seed))
+    lines, length = [], 0
+    for line in kinds[kind](rnd):
+        lines.append(line)
+        length += len(line) + 1
+        if length >= min(size, block_size):
+            break
+    block = "\n".join(lines) + "\n"
+    text = block * (size // len(block) + 1)
+    # Cut at a line end, so that no color is broken.
+    end = text.rfind("\n", 0, size) + 1
+    return text[:end or size]
+
+
+def parse_size(text):
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit, scale in (("G", 1 << 30), ("M", 1 << 20), ("K", 1 << 10)):
+        if size >= scale:
+            return "%g%s" % (round(size / scale, 1), unit)
+    return str(size)
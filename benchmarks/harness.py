@@ -0,0 +1,181 @@
+import importlib
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(1, os.path.join(ROOT, "tools"))
+
+import sublime
+import sublime_plugin
+from common import PACKAGE, register_package
+
+
+def load_package(name=PACKAGE):
+    return importlib.import_module(name + ".painter")
+
+
+register_package(ROOT)
+
+
+class Editor(object):
+    # Drives the plugin the way sublime would: it sends the events of
+    # opening, editing, selecting and closing views to the listeners and
+    # runs the timeouts they schedule.
+    def __init__(self, root=ROOT):
+        sublime._settings_roots.append(root)
+        self.painter = load_package()
+        self.window = sublime.Window()
+        self.listeners = [cls() for cls in sublime_plugin.all_event_listeners]
+        self.scheme_writes = 0
+        self.count_scheme_writes()
+        self.scratch = sublime.View(self.window, sublime.Buffer(""))
+        self.window._views.append(self.scratch)
+        self.window._groups[0].append(self.scratch)
+        self.window._active = self.scratch
+
+    def count_scheme_writes(self):
+        writer = self.painter.ColorSchemeWriter
+        write_color_scheme = writer.write_color_scheme
+
+        def counted(cswriter, rules):
+            digest = cswriter.digest
+            write_color_scheme(cswriter, rules)
+            if cswriter.digest != digest:
+                self.scheme_writes += 1
+
+        writer.write_color_scheme = counted
+
+    def start(self):
+        self.painter.plugin_loaded()
+        self.run()
+
+    def run(self):
+        return sublime._run_pending()
+
+    def settings(self, name="ColorPainter.sublime-settings"):
+        return sublime.load_settings(name)
+
+    def event(self, name, *args):
+        for listener in self.listeners:
+            for n in (name, name + "_async"):
+                f = getattr(listener, n, None)
+                if f is not None:
+                    f(*args)
+
+    def open(self, text, file_name="/tmp/x.css", group=0):
+        buf = sublime.Buffer(text, file_name)
+        view = sublime.View(self.window, buf)
+        self.window._views.append(view)
+        self.window._groups[group].append(view)
+        self.window._active = view
+        for cls in sublime_plugin.all_text_change_listeners:
+            if cls.is_applicable(buf):
+                cls().attach(buf)
+        self.event("on_load", view)
+        self.event("on_activated", view)
+        self.run()
+        return view
+
+    def clone(self, view):
+        clone = sublime.View(self.window, view._buffer)
+        self.window._views.append(clone)
+        self.window._groups[0].append(clone)
+        self.window._active = clone
+        self.event("on_activated", clone)
+        self.run()
+        return clone
+
+    def activate(self, view):
+        self.window._active = view
+        self.event("on_activated", view)
+        self.run()
+
+    def close(self, view):
+        self.event("on_pre_close", view)
+        self.window._views.remove(view)
+        for g in self.window._groups:
+            if view in g:
+                g.remove(view)
+        view._buffer._views.remove(view)
+        view._valid = False
+        if not view._buffer._views:
+            for tl in list(view._buffer.text_listeners):
+                tl.detach()
+        self.event("on_close", view)
+        self.run()
+
+    def replace(self, view, a, b, text, run=True):
+        self.replace_many(view, [(a, b, text)], run)
+
+    def replace_many(self, view, edits, run=True):
+        # edits apply in order, each at positions of the text left by
+        # the previous ones, like the changes of one command.
+        buf = view._buffer
+        changes = []
+        for a, b, text in edits:
+            old = buf.text
+            buf.text = old[:a] + text + old[b:]
+            for v in buf._views:
+                v._line_starts = None
+                v._shift(a, b - a, len(text))
+            changes.append(sublime.TextChange(
+                self.position(old, a), self.position(old, b), text))
+        buf.change_count += 1
+        buf.dirty = True
+        for tl in list(buf.text_listeners):
+            for n in ("on_text_changed", "on_text_changed_async"):
+                f = getattr(tl, n, None)
+                if f is not None:
+                    f(changes)
+        for v in buf._views:
+            self.event("on_modified", v)
+            self.event("on_selection_modified", v)
+        if run:
+            self.run()
+
+    def position(self, text, pt):
+        row = text.count("\n", 0, pt)
+        col = pt - text.rfind("\n", 0, pt) - 1
+        return sublime.HistoricPosition(pt, row, col)
+
+    def insert(self, view, pt, text, run=True):
+        self.replace(view, pt, pt, text, run)
+
+    def erase(self, view, a, b, run=True):
+        self.replace(view, a, b, "", run)
+
+    def type(self, view, text):
+        for ch in text:
+            pts = [r.b for r in view.sel()]
+            for pt in reversed(pts):
+                self.insert(view, pt, ch, run=False)
+            self.run()
+
+    def select(self, view, points):
+        view._sel.clear()
+        view._sel.add_all(points)
+        self.event("on_selection_modified", view)
+        self.run()
+
+    def scroll(self, view, a, b):
+        view._viewport = (a, b)
+        self.event("on_selection_modified", view)
+        self.run()
+
+    def colors(self, view):
+        out = []
+        for key, (regions, scope, icon, flags) in view._regions.items():
+            if flags & sublime.HIDDEN:
+                continue
+            for r in regions:
+                out.append((r.begin(), r.end(), scope))
+        return sorted(out)
+
+    def scheme_files(self):
+        dirname = self.painter.profile._color_scheme_cache_dir(relative=False)
+        if not os.path.isdir(dirname):
+            return []
+        return [os.path.join(dirname, f) for f in sorted(os.listdir(dirname))
+                if f.endswith(".sublime-color-scheme")]
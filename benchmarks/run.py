@@ -0,0 +1,183 @@
+"""Headless benchmarks of ColorPainter.
+
+    python benchmarks/run.py [--sizes 1K,100K,1M,10M] [--kinds css,code,dense]
+                             [--json results.json]
+
+Each corpus is opened in a view of the stub editor, which then goes through
+the scenarios below. Every scenario reports its wall time, the sublime API
+calls it made, the color scheme files written and their size.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import harness
+import corpora
+import sublime
+
+
+def scenario_load(editor, text):
+    return editor.open(text, file_name="/tmp/benchmark.css")
+
+
+def scenario_scroll(editor, view):
+    # Page through the file like a reader, ten screens from top to bottom.
+    size = view.size()
+    page = 4000
+    for i in range(10):
+        a = (size - page) * i // 9 if size > page else 0
+        editor.scroll(view, a, a + page)
+
+
+def scenario_typing(editor, view):
+    pt = view.size() // 2
+    pt = view._buffer.text.rfind("\n", 0, pt) + 1
+    editor.scroll(view, pt, pt + 4000)
+    editor.select(view, [pt])
+    editor.type(view, "color: #a1b2c3; background: rgb(1, 2, 3);\n")
+
+
+def scenario_selection(editor, view):
+    # Put the caret on a hundred colors in the viewport, one by one.
+    colors = [c for c in editor.colors(view) if not c[2].endswith("s")]
+    step = max(1, len(colors) // 100)
+    for begin, end, scope in colors[::step][:100]:
+        editor.select(view, [begin + 1])
+    editor.select(view, [0])
+
+
+def scenario_settings(editor, view):
+    settings = editor.settings()
+    modes = settings.get("color_modes")
+    settings.set("gutter_icon", "dot")
+    editor.run()
+    settings.set("gutter_icon", "circle")
+    editor.run()
+    settings.set("color_modes", [m for m in modes if m != "css_named"])
+    editor.run()
+    settings.set("color_modes", modes)
+    editor.run()
+
+
+def scenario_color_scheme(editor, view):
+    # Switch between a light and a dark scheme, like an automatic theme.
+    preferences = editor.settings("Preferences.sublime-settings")
+    original = preferences.get("color_scheme")
+    for i in range(4):
+        preferences.set("color_scheme", "Mariana Light.sublime-color-scheme")
+        editor.run()
+        preferences.set("color_scheme", "Monokai.sublime-color-scheme")
+        editor.run()
+    if original is not None:
+        preferences.set("color_scheme", original)
+        editor.run()
+
+
+def scenario_clone(editor, view):
+    # Split the file into a second pane, type in it, and close it.
+    clone = editor.clone(view)
+    editor.select(clone, [0])
+    editor.type(clone, "#abcdef ")
+    editor.close(clone)
+    editor.activate(view)
+
+
+def scenario_close(editor, view):
+    editor.close(view)
+
+
+scenarios = [
+    ("load", scenario_load),
+    ("scroll", scenario_scroll),
+    ("typing", scenario_typing),
+    ("selection", scenario_selection),
+    ("settings", scenario_settings),
+    ("scheme", scenario_color_scheme),
+    ("clone", scenario_clone),
+    ("close", scenario_close),
+]
+
+
+def scheme_stats(editor):
+    files = editor.scheme_files()
+    size = sum(os.path.getsize(f) for f in files)
+    rules = 0
+    for f in files:
+        with open(f) as file:
+            rules += len(json.load(file)["rules"])
+    return size, rules
+
+
+def run_corpus(editor, kind, size):
+    text = corpora.generate(kind, size)
+    results = []
+    view = None
+    for name, scenario in scenarios:
+        sublime._api_calls.clear()
+        writes = editor.scheme_writes
+        start = time.perf_counter()
+        if view is None:
+            view = scenario(editor, text)
+        else:
+            scenario(editor, view)
+        elapsed = time.perf_counter() - start
+        scheme_size, scheme_rules = scheme_stats(editor)
+        results.append({
+            "kind": kind,
+            "size": len(text),
+            "scenario": name,
+            "ms": round(elapsed * 1000, 2),
+            "colors": len(editor.colors(view)) if view._valid else 0,
+            "api_calls": dict(sublime._api_calls),
+            "scheme_writes": editor.scheme_writes - writes,
+            "scheme_bytes": scheme_size,
+            "scheme_rules": scheme_rules,
+        })
+    return results
+
+
+def format_calls(calls, top=4):
+    calls = sorted(calls.items(), key=lambda item: -item[1])
+    return " ".join("%s=%d" % item for item in calls[:top])
+
+
+def report(results, file=sys.stdout):
+    header = "%-6s %6s %-10s %10s %8s %6s %7s %6s  %s" % (
+        "kind", "size", "scenario", "ms", "colors", "writes",
+        "scheme", "rules", "api calls")
+    print(header, file=file)
+    print("-" * len(header), file=file)
+    for r in results:
+        print("%-6s %6s %-10s %10.2f %8d %6d %7s %6d  %s" % (
+            r["kind"], corpora.format_size(r["size"]), r["scenario"],
+            r["ms"], r["colors"], r["scheme_writes"],
+            corpora.format_size(r["scheme_bytes"]), r["scheme_rules"],
+            format_calls(r["api_calls"])), file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1K,100K,1M,10M",
+                        help="comma separated corpus sizes, up to 100M")
+    parser.add_argument("--kinds", default=",".join(corpora.kinds),
+                        help="comma separated corpus kinds")
+    parser.add_argument("--json", metavar="PATH",
+                        help="also write the results to PATH")
+    args = parser.parse_args(argv)
+
+    editor = harness.Editor()
+    editor.start()
+    results = []
+    for kind in args.kinds.split(","):
+        for size in args.sizes.split(","):
+            results.extend(run_corpus(editor, kind, corpora.parse_size(size)))
+    report(results)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,558 @@
+# An in-memory stand-in for the parts of the sublime module used by
+# ColorPainter. Timeouts run on a virtual clock, see _run_pending().
+import atexit
+import bisect
+import collections
+import heapq
+import os
+import shutil
+import tempfile
+
+
+DRAW_EMPTY = 1
+HIDE_ON_MINIMAP = 2
+DRAW_EMPTY_AS_OVERWRITE = 4
+PERSISTENT = 16
+DRAW_NO_FILL = 32
+DRAW_OUTLINED = DRAW_NO_FILL
+HIDDEN = 128
+DRAW_NO_OUTLINE = 256
+DRAW_SOLID_UNDERLINE = 512
+
+_api_calls = collections.Counter()
+_timeouts = []
+_async_timeouts = []
+_windows = []
+_settings = {}
+_data_path = tempfile.mkdtemp(prefix="cp_data_")
+_packages_path = os.path.join(_data_path, "Packages")
+_cache_path = os.path.join(_data_path, "Cache")
+atexit.register(shutil.rmtree, _data_path, True)
+_next_id = [0]
+
+
+def _count(name):
+    _api_calls[name] += 1
+
+
+def _new_id():
+    _next_id[0] += 1
+    return _next_id[0]
+
+
+def version():
+    return "4180"
+
+
+def packages_path():
+    return _packages_path
+
+
+def cache_path():
+    return _cache_path
+
+
+def find_resources(pattern):
+    import fnmatch
+    _count("find_resources")
+    found = []
+    for dirpath, dirnames, filenames in os.walk(_packages_path):
+        for name in filenames:
+            if fnmatch.fnmatch(name, pattern):
+                path = os.path.relpath(os.path.join(dirpath, name),
+                                       _packages_path)
+                found.append("Packages/" + path.replace(os.sep, "/"))
+    return sorted(found)
+
+
+def load_binary_resource(name):
+    _count("load_binary_resource")
+    path = os.path.join(_packages_path, name[len("Packages/"):])
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def error_message(msg):
+    print("error_message:", msg)
+
+
+def status_message(msg):
+    pass
+
+
+_clock = [0.0]
+_sequence = [0]
+
+
+def _schedule(queue, f, delay):
+    _sequence[0] += 1
+    heapq.heappush(queue, (_clock[0] + delay, _sequence[0], f))
+
+
+def set_timeout(f, delay=0):
+    _count("set_timeout")
+    _schedule(_timeouts, f, delay)
+
+
+def set_timeout_async(f, delay=0):
+    _count("set_timeout_async")
+    _schedule(_async_timeouts, f, delay)
+
+
+def _run_pending(horizon=5000):
+    # Run callbacks in virtual time order until `horizon` milliseconds
+    # of virtual time have passed, and return how many of them ran.
+    deadline = _clock[0] + horizon
+    ran = 0
+    while _timeouts or _async_timeouts:
+        queue = min((q for q in (_async_timeouts, _timeouts) if q),
+                    key=lambda q: q[0][:2])
+        if queue[0][0] > deadline:
+            break
+        when, _, f = heapq.heappop(queue)
+        _clock[0] = max(_clock[0], when)
+        f()
+        ran += 1
+    _clock[0] = deadline
+    return ran
+
+
+_settings_roots = []
+
+
+def _parse_settings(path):
+    import json
+    import re
+    with open(path) as file:
+        text = file.read()
+    text = re.sub(r"^\s*//.*$", "", text, flags=re.M)
+    text = re.sub(r",(\s*[}\]])", r"\1", text)
+    return json.loads(text)
+
+
+def load_settings(name):
+    if name not in _settings:
+        values = {}
+        for root in _settings_roots:
+            path = os.path.join(root, name)
+            if os.path.exists(path):
+                values.update(_parse_settings(path))
+        _settings[name] = Settings(values)
+    return _settings[name]
+
+
+def active_window():
+    return _windows[0]
+
+
+def windows():
+    return list(_windows)
+
+
+class Region(object):
+    __slots__ = ("a", "b", "xpos")
+
+    def __init__(self, a, b=None, xpos=-1):
+        if b is None:
+            b = a
+        self.a = a
+        self.b = b
+        self.xpos = xpos
+
+    def __repr__(self):
+        return "Region({}, {})".format(self.a, self.b)
+
+    def __len__(self):
+        return self.size()
+
+    def __eq__(self, rhs):
+        return isinstance(rhs, Region) and self.a == rhs.a and self.b == rhs.b
+
+    def __hash__(self):
+        return hash((self.a, self.b))
+
+    def __lt__(self, rhs):
+        return self.begin() < rhs.begin()
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return abs(self.a - self.b)
+
+    def empty(self):
+        return self.a == self.b
+
+    def contains(self, x):
+        if isinstance(x, Region):
+            return x.begin() >= self.begin() and x.end() <= self.end()
+        return self.begin() <= x <= self.end()
+
+    def intersects(self, rhs):
+        lb, le = self.begin(), self.end()
+        rb, re = rhs.begin(), rhs.end()
+        return (lb == rb and le == re) or (rb > lb and rb < le) or (
+            lb > rb and lb < re)
+
+    def cover(self, rhs):
+        return Region(min(self.begin(), rhs.begin()),
+                      max(self.end(), rhs.end()))
+
+
+class Selection(object):
+    def __init__(self, view):
+        self.view = view
+        self.regions = [Region(0)]
+
+    def __iter__(self):
+        return iter(list(self.regions))
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __getitem__(self, i):
+        return self.regions[i]
+
+    def clear(self):
+        self.regions = []
+
+    def add(self, x):
+        if not isinstance(x, Region):
+            x = Region(x)
+        self.regions.append(x)
+        self.regions.sort(key=lambda r: r.begin())
+
+    def add_all(self, xs):
+        self.regions.extend(x if isinstance(x, Region) else Region(x)
+                            for x in xs)
+        self.regions.sort(key=lambda r: r.begin())
+
+
+class Settings(object):
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+        self.callbacks = {}
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+        for cb in list(self.callbacks.values()):
+            cb()
+
+    def has(self, key):
+        return key in self.values
+
+    def erase(self, key):
+        self.values.pop(key, None)
+
+    def add_on_change(self, tag, callback):
+        self.callbacks[tag] = callback
+
+    def clear_on_change(self, tag):
+        self.callbacks.pop(tag, None)
+
+
+class HistoricPosition(object):
+    __slots__ = ("pt", "row", "col", "row_utf16", "col_utf16")
+
+    def __init__(self, pt, row, col):
+        self.pt = pt
+        self.row = row
+        self.col = col
+        self.row_utf16 = row
+        self.col_utf16 = col
+
+
+class TextChange(object):
+    __slots__ = ("a", "b", "len_utf16", "len_utf8", "str")
+
+    def __init__(self, a, b, s):
+        self.a = a
+        self.b = b
+        self.str = s
+        self.len_utf16 = len(s)
+        self.len_utf8 = len(s.encode("utf-8"))
+
+
+class Buffer(object):
+    def __init__(self, text="", file_name=None):
+        self.buffer_id = _new_id()
+        self.text = text
+        self._file_name = file_name
+        self._views = []
+        self.change_count = 0
+        self.dirty = False
+        self.text_listeners = []
+
+    def id(self):
+        return self.buffer_id
+
+    def file_name(self):
+        return self._file_name
+
+    def views(self):
+        return list(self._views)
+
+    def primary_view(self):
+        return self._views[0] if self._views else None
+
+
+class View(object):
+    def __init__(self, window, buffer, name=""):
+        self.view_id = _new_id()
+        self._window = window
+        self._buffer = buffer
+        buffer._views.append(self)
+        self._regions = {}
+        self._settings = Settings({"syntax": "Packages/Text/Plain text.tmLanguage"})
+        self._sel = Selection(self)
+        self._viewport = (0, 4000)
+        self._scopes = []
+        self._valid = True
+        self._line_starts = None
+
+    def __eq__(self, rhs):
+        return isinstance(rhs, View) and rhs.view_id == self.view_id
+
+    def __hash__(self):
+        return self.view_id
+
+    def __repr__(self):
+        return "View({})".format(self.view_id)
+
+    def id(self):
+        return self.view_id
+
+    def buffer_id(self):
+        return self._buffer.buffer_id
+
+    def buffer(self):
+        return self._buffer
+
+    def is_valid(self):
+        return self._valid
+
+    def is_primary(self):
+        return self._buffer.primary_view() is self
+
+    def clones(self):
+        return [v for v in self._buffer._views if v is not self]
+
+    def window(self):
+        return self._window
+
+    def file_name(self):
+        return self._buffer._file_name
+
+    def name(self):
+        return ""
+
+    def size(self):
+        _count("size")
+        return len(self._buffer.text)
+
+    def change_count(self):
+        _count("change_count")
+        return self._buffer.change_count
+
+    def is_dirty(self):
+        return self._buffer.dirty
+
+    def settings(self):
+        return self._settings
+
+    def style(self):
+        _count("style")
+        scheme = self._settings.get("color_scheme", "")
+        if "Light" in scheme or "light" in scheme:
+            return {"background": "#fafafa", "foreground": "#383a42"}
+        return {"background": "#272822", "foreground": "#f8f8f2"}
+
+    def substr(self, x):
+        _count("substr")
+        text = self._buffer.text
+        if isinstance(x, Region):
+            return text[x.begin():x.end()]
+        return text[x:x + 1]
+
+    def _starts(self):
+        if self._line_starts is None:
+            starts = [0]
+            text = self._buffer.text
+            i = text.find("\n")
+            while i >= 0:
+                starts.append(i + 1)
+                i = text.find("\n", i + 1)
+            self._line_starts = starts
+        return self._line_starts
+
+    def rowcol(self, pt):
+        _count("rowcol")
+        starts = self._starts()
+        row = bisect.bisect_right(starts, pt) - 1
+        return row, pt - starts[row]
+
+    def text_point(self, row, col):
+        _count("text_point")
+        starts = self._starts()
+        return starts[min(row, len(starts) - 1)] + col
+
+    def line(self, x):
+        _count("line")
+        if isinstance(x, Region):
+            a, b = x.begin(), x.end()
+        else:
+            a = b = x
+        text = self._buffer.text
+        start = text.rfind("\n", 0, a) + 1
+        end = text.find("\n", b)
+        if end < 0:
+            end = len(text)
+        return Region(start, end)
+
+    def full_line(self, x):
+        region = self.line(x)
+        if region.b < len(self._buffer.text):
+            region = Region(region.a, region.b + 1)
+        return region
+
+    def lines(self, region):
+        _count("lines")
+        out = []
+        pt = region.begin()
+        while True:
+            line = self.line(pt)
+            out.append(line)
+            if line.b >= region.end() or line.b >= len(self._buffer.text):
+                break
+            pt = line.b + 1
+        return out
+
+    def sel(self):
+        _count("sel")
+        return self._sel
+
+    def visible_region(self):
+        _count("visible_region")
+        a, b = self._viewport
+        return Region(a, min(b, len(self._buffer.text)))
+
+    def viewport_position(self):
+        return (0.0, float(self._viewport[0]))
+
+    def add_regions(self, key, regions, scope="", icon="", flags=0):
+        _count("add_regions")
+        self._regions[key] = (sorted((Region(r.a, r.b) for r in regions),
+                                     key=lambda r: r.begin()),
+                              scope, icon, flags)
+
+    def get_regions(self, key):
+        _count("get_regions")
+        if key in self._regions:
+            return [Region(r.a, r.b) for r in self._regions[key][0]]
+        return []
+
+    def erase_regions(self, key):
+        _count("erase_regions")
+        self._regions.pop(key, None)
+
+    def match_selector(self, pt, selector):
+        _count("match_selector")
+        return any(r.a <= pt < r.b for r in self.find_by_selector(selector))
+
+    def scope_name(self, pt):
+        return "text.plain "
+
+    def find_by_selector(self, selector):
+        _count("find_by_selector")
+        return [Region(a, b) for a, b, scope in self._scopes
+                if any(s.strip() and s.strip() in scope
+                       for s in selector.split(","))]
+
+    def syntax(self):
+        return None
+
+    def run_command(self, cmd, args=None):
+        pass
+
+    def _shift(self, p, removed, inserted):
+        delta = inserted - removed
+        q = p + removed
+        for key, (regions, scope, icon, flags) in self._regions.items():
+            moved = []
+            for r in regions:
+                if r.a < p and r.b < p:
+                    moved.append(r)
+                    continue
+                a, b = r.begin(), r.end()
+                if a >= p:
+                    a = a + delta if a >= q else p
+                if b > p or (b == p and a > p):
+                    b = b + delta if b >= q else p + inserted
+                if b < a:
+                    b = a
+                moved.append(Region(a, b))
+            self._regions[key] = (moved, scope, icon, flags)
+        sels = []
+        for r in self._sel.regions:
+            pt = r.b
+            if pt >= q:
+                pt += delta
+            elif pt > p:
+                pt = p + inserted
+            sels.append(Region(pt))
+        self._sel.regions = sels
+
+
+class Window(object):
+    def __init__(self):
+        self.window_id = _new_id()
+        self._views = []
+        self._groups = [[]]
+        self._active = None
+        self._panels = {}
+        _windows.append(self)
+
+    def id(self):
+        return self.window_id
+
+    def views(self):
+        return list(self._views)
+
+    def active_view(self):
+        return self._active
+
+    def num_groups(self):
+        return len(self._groups)
+
+    def active_view_in_group(self, group):
+        views = self._groups[group]
+        for view in views:
+            if view is self._active:
+                return view
+        return views[0] if views else None
+
+    def views_in_group(self, group):
+        return list(self._groups[group])
+
+    def get_view_index(self, view):
+        for g, views in enumerate(self._groups):
+            if view in views:
+                return g, views.index(view)
+        return -1, -1
+
+    def create_output_panel(self, name, unlisted=False):
+        panel = View(self, Buffer())
+        self._panels[name] = panel
+        return panel
+
+    def find_output_panel(self, name):
+        return self._panels.get(name)
+
+    def run_command(self, cmd, args=None):
+        pass
@@ -0,0 +1,72 @@
+# An in-memory stand-in for sublime_plugin, which records the classes
+# the plugin defines so the harness can instantiate them.
+import sublime
+
+all_event_listeners = []
+all_text_change_listeners = []
+all_commands = []
+
+
+class _Registry(type):
+    def __init__(cls, name, bases, ns):
+        super().__init__(name, bases, ns)
+        if bases and bases[0] is not object:
+            if issubclass(cls, EventListener) and cls is not EventListener:
+                all_event_listeners.append(cls)
+            elif issubclass(cls, TextChangeListener) and cls is not TextChangeListener:
+                all_text_change_listeners.append(cls)
+            elif cls.__name__.endswith("Command"):
+                all_commands.append(cls)
+
+
+class EventListener(metaclass=_Registry):
+    pass
+
+
+class ViewEventListener(metaclass=_Registry):
+    def __init__(self, view):
+        self.view = view
+
+
+class TextChangeListener(metaclass=_Registry):
+    def __init__(self):
+        self.buffer = None
+
+    @classmethod
+    def is_applicable(cls, buffer):
+        return True
+
+    def attach(self, buffer):
+        self.buffer = buffer
+        buffer.text_listeners.append(self)
+
+    def detach(self):
+        if self.buffer is not None:
+            self.buffer.text_listeners.remove(self)
+        self.buffer = None
+
+    def is_attached(self):
+        return self.buffer is not None
+
+
+class _Command(metaclass=_Registry):
+    def name(self):
+        import re
+        n = type(self).__name__
+        if n.endswith("Command"):
+            n = n[:-7]
+        return re.sub(r"(?<!^)(?=[A-Z])", "_", n).lower()
+
+
+class TextCommand(_Command):
+    def __init__(self, view):
+        self.view = view
+
+
+class WindowCommand(_Command):
+    def __init__(self, window):
+        self.window = window
+
+
+class ApplicationCommand(_Command):
+    pass
@@ -0,0 +1,78 @@
+import colorsys
+import functools
+
+from .sublime_css_colors import sublime_css_color_values
+
+
+def parse_alpha(text):
+    return int(round(float(text) * 255))
+
+
+def parse_percent(text):
+    return float(text.rstrip("%")) / 100
+
+
+def parse_rgb(args):
+    return [int(arg) for arg in args]
+
+
+def parse_hsl(args):
+    h = float(args[0]) / 360
+    l = parse_percent(args[2])
+    s = parse_percent(args[1])
+    return [int(round(c * 255)) for c in colorsys.hls_to_rgb(h, l, s)]
+
+
+def parse_hex(text):
+    digits = text[1:]
+    if len(digits) <= 4:
+        digits = "".join(d + d for d in digits)
+    values = [int(digits[i:i + 2], 16) for i in range(0, len(digits), 2)]
+    return values + [255] * (4 - len(values))
+
+
+functions = {
+    "rgb": parse_rgb,
+    "hsl": parse_hsl,
+}
+
+
+def parse(text):
+    # Returns [red, green, blue, alpha], each in 0-255, or None.
+    try:
+        if text.startswith("#"):
+            return parse_hex(text)
+        if text in sublime_css_color_values:
+            return parse_hex(sublime_css_color_values[text])
+        name, args = text.rstrip(")").split("(")
+        args = [arg.strip() for arg in args.split(",")]
+        rgb = functions[name[:3]](args[:3])
+        alpha = parse_alpha(args[3]) if name.endswith("a") else 255
+        return rgb + [alpha]
+    except (KeyError, ValueError, IndexError):
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize(text):
+    # The lowercase #rrggbb form of a color, or #rrggbbaa if it is not
+    # opaque. Text which is not a color is returned unchanged.
+    rgba = parse(text)
+    if rgba is None:
+        return text
+    if rgba[3] == 255:
+        return "#%02x%02x%02x" % tuple(rgba[:3])
+    return "#%02x%02x%02x%02x" % tuple(rgba)
+
+
+def normalize_spans(spans):
+    # spans: (begin, end, text) tuples, with many repeated texts in a
+    # scan result; each distinct text is normalized once.
+    known = {}
+    normalized = []
+    for begin, end, text in spans:
+        color = known.get(text)
+        if color is None:
+            color = known[text] = normalize(text)
+        normalized.append((begin, end, color))
+    return normalized
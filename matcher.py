@@ -0,0 +1,145 @@
+import re
+
+from .sublime_css_colors import sublime_css_colors
+
+
+sep = r",\s?"
+
+rgb255 = r"(?:[01]?[0-9]?[0-9]|2(?:[0-4][0-9]|5[0-5]))"
+rgb_values = sep.join([rgb255, rgb255, rgb255])
+
+pec  = r"(?:100(?:\.0*)?|[0-9][0-9]?(?:\.[0-9]*)?|\.[0-9]+)%"
+hsl360 = r"(?:360(?:\.0*)?|(?:[0-2]?[0-9]?[0-9]|3[0-5][0-9])(?:\.[0-9]*)?|\.[0-9]+)"
+hsl_values = sep.join([hsl360, pec, pec])
+
+alpah_channel =  sep + r"(?:0?\.[0-9]+|1\.0?|[01])"
+
+# Colors longer than this are very unlikely, so this is how far an edit
+# can reach to make or break a color around it.
+MAX_COLOR_LENGTH = 64
+
+
+color_regexs = {
+    "hex8": r"#[0-9a-fA-F]{8}\b",
+    "hex6": r"#[0-9a-fA-F]{6}\b",
+    "hex4": r"#[0-9a-fA-F]{4}\b",
+    "hex3": r"#[0-9a-fA-F]{3}\b",
+    "rgb": r"rgb\(" + rgb_values + r"\)",
+    "hsl": r"hsl\(" + hsl_values + r"\)",
+    "rgba": r"rgba\(" + rgb_values + alpah_channel + r"\)",
+    "hsla": r"hsla\(" + hsl_values + alpah_channel + r"\)",
+    "css_named": r"\b(?:" + r"|".join(sublime_css_colors) + r")\b"
+}
+
+hex_lengths = {"hex8": 8, "hex6": 6, "hex4": 4, "hex3": 3}
+
+function_values = {
+    "rgb": rgb_values,
+    "hsl": hsl_values,
+}
+
+
+def trie_regex(words):
+    # Factor the common prefixes of words:
+    # ["red", "rebeccapurple"] -> "re(?:beccapurple|d)"
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        alts = [re.escape(char) + build(node[char])
+                for char in sorted(node) if char]
+        if not alts:
+            return ""
+        regex = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            if len(alts) == 1 and len(regex) > 1:
+                regex = "(?:" + regex + ")"
+            regex += "?"
+        return regex
+
+    return build(trie)
+
+
+def hex_regex(lengths):
+    # Nest the longer lengths into the shorter ones:
+    # [3, 4, 6, 8] -> "#H{3}(?:H{1}(?:H{2}(?:H{2})?)?)?\b"
+    regex = ""
+    for a, b in reversed(list(zip(lengths, lengths[1:]))):
+        regex = "(?:[0-9a-fA-F]{%d}%s)?" % (b - a, regex)
+    return "#[0-9a-fA-F]{%d}%s\\b" % (lengths[0], regex)
+
+
+def color_mode_of(text):
+    # The color mode of a color found by a ColorMatcher.
+    if text.startswith("#"):
+        return "hex%d" % (len(text) - 1)
+    i = text.find("(")
+    if i > 0:
+        return text[:i]
+    return "css_named"
+
+
+class ColorMatcher(object):
+    # One matcher per set of color modes, shared by all the views using
+    # the same modes.
+    matchers = {}
+
+    @classmethod
+    def get(cls, color_modes):
+        key = tuple(sorted(set(color_modes) & set(color_regexs)))
+        if not key:
+            # The regex would match the empty string everywhere.
+            raise ValueError("no color modes in %r" % (color_modes,))
+        if key not in cls.matchers:
+            cls.matchers[key] = cls(key)
+        return cls.matchers[key]
+
+    def __init__(self, color_modes):
+        self.color_modes = color_modes
+        self.regex = re.compile(self.build_regex(color_modes))
+
+    def build_regex(self, color_modes):
+        # Every top level branch starts with a literal character, which
+        # lets the regex engine skip quickly over the text between colors.
+        branches = []
+        lengths = sorted(hex_lengths[m] for m in color_modes if m in hex_lengths)
+        if lengths:
+            branches.append(hex_regex(lengths))
+
+        heads = {}
+        for function, values in function_values.items():
+            tails = []
+            if function in color_modes:
+                tails.append(r"\(" + values + r"\)")
+            if function + "a" in color_modes:
+                tails.append(r"a\(" + values + alpah_channel + r"\)")
+            if tails:
+                tail = tails[0] if len(tails) == 1 else "(?:%s)" % "|".join(tails)
+                heads.setdefault(function[0], []).append(
+                    re.escape(function[1:]) + tail)
+
+        if "css_named" in color_modes:
+            names = {}
+            for name in sublime_css_colors:
+                names.setdefault(name[0], []).append(name[1:])
+            for first, rests in names.items():
+                # The lookbehind stands for the \b before the name, once
+                # its first character is matched.
+                heads.setdefault(first, []).append(
+                    r"(?<!\w%s)%s\b" % (first, trie_regex(rests)))
+
+        for first in sorted(heads):
+            tails = heads[first]
+            tail = tails[0] if len(tails) == 1 else "(?:%s)" % "|".join(tails)
+            branches.append(re.escape(first) + tail)
+
+        return "|".join(branches)
+
+    def finditer(self, text, pos=0, endpos=None):
+        if endpos is None:
+            endpos = len(text)
+        return self.regex.finditer(text, pos, endpos)
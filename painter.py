@@ -1,11 +1,19 @@
 import sublime
 import sublime_plugin
 
-import re
 import os
 import json
+import time
+import bisect
+import itertools
+import hashlib
 
 from . import profile
+from .spans import ColorSpans
+from .matcher import ColorMatcher, color_mode_of, MAX_COLOR_LENGTH
+from .stats import Stats
+from .scancache import ScanCache
+from .colors import normalize_spans
 
 
 DEFAULT_COLOR_SCHEME = "Monokai.sublime-color-scheme"
@@ -45,14 +53,83 @@ class ColorPainterClearViewCommand(ColorPainterCommand):
         ColorPainterViewsManager.clear_view(self.view)
 
 
+class ColorPainterShowStatsCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        window = self.view.window()
+        panel = window.create_output_panel("color_painter_stats")
+        panel.run_command("append",
+            {"characters": ColorPainterViewsManager.stats.report()})
+        window.run_command("show_panel",
+            {"panel": "output.color_painter_stats"})
+
+
 class ColorSchemeWriter(object):
-    def __init__(self, color_scheme):
-        view = sublime.active_window().active_view()
-        view.settings().set("color_scheme", color_scheme)
+    # Milliseconds to gather dirty notifications before writing.
+    write_delay = 100
+    # The backgrounds of the color schemes seen, by the digest of their
+    # files, in the cache directory.
+    backgrounds_name = "backgrounds.json"
 
-        self.bg_selection = view.style()["background"]
+    def __init__(self, color_scheme):
+        self.bg_selection = self.scheme_background(color_scheme)
         self.bg_full_text = self.nearest_color(self.bg_selection)
         self.abspath = profile._color_scheme_cache_path(color_scheme)
+        self.digest = self.file_digest(self.abspath)
+        self.write_pending = False
+        # milliseconds taken by the last write
+        self.write_cost = 0.0
+        # version of the color registry written last
+        self.written_version = None
+
+    def scheme_background(self, color_scheme):
+        # Reading the background takes switching a view to the scheme, so
+        # it is only done when the files of the scheme have changed.
+        path = os.path.join(profile._color_scheme_cache_dir(relative=False),
+                            self.backgrounds_name)
+        digest = self.scheme_digest(color_scheme)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                backgrounds = json.load(file)
+        except (OSError, ValueError):
+            backgrounds = {}
+        entry = backgrounds.get(color_scheme)
+        if entry and entry.get("digest") == digest:
+            return entry["background"]
+
+        view = sublime.active_window().active_view()
+        view.settings().set("color_scheme", color_scheme)
+        background = view.style()["background"]
+        backgrounds[color_scheme] = {
+            "digest": digest, "background": background}
+        try:
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(backgrounds, file)
+        except OSError:
+            pass
+        return background
+
+    def scheme_digest(self, color_scheme):
+        # The files of the scheme, along with those overriding it, but not
+        # the ones written here.
+        written = profile._color_scheme_cache_dir()
+        md5 = hashlib.md5()
+        for path in sublime.find_resources(os.path.basename(color_scheme)):
+            if path.startswith(written):
+                continue
+            try:
+                content = sublime.load_binary_resource(path)
+            except OSError:
+                continue
+            md5.update(path.encode("utf-8"))
+            md5.update(content)
+        return md5.hexdigest()
+
+    def file_digest(self, path):
+        try:
+            with open(path, "rb") as file:
+                return hashlib.md5(file.read()).hexdigest()
+        except OSError:
+            return None
 
     def nearest_color(self, color):
         b = int(color[5:7], 16)
@@ -71,208 +148,1187 @@ class ColorSchemeWriter(object):
             bgcolor = self.bg_selection
         return rules
 
+    def scheme_rules(self):
+        # Rules with the backgrounds of this scheme, whichever scheme is
+        # current when they are written.
+        manager = ColorPainterViewsManager
+        return manager.color_registry.scheme_rules(
+            self.make_rule(manager.style_full_text),
+            self.make_rule(manager.style_selection))
+
+    def schedule_write(self):
+        if self.write_pending:
+            return
+
+        def flush():
+            self.write_pending = False
+            manager = ColorPainterViewsManager
+            stats = manager.stats
+            manager.color_registry.prune()
+            version = (manager.color_registry.version,
+                       manager.style_full_text, manager.style_selection)
+            if version == self.written_version:
+                # The scheme holds these colors already, such as when
+                # switching back to it.
+                stats.count("scheme_skips")
+                return
+            start = time.perf_counter()
+            with stats.timer("scheme"):
+                # Written even without rules, to drop those of the colors
+                # gone.
+                self.write_color_scheme(self.scheme_rules())
+            self.written_version = version
+            self.write_cost = (time.perf_counter() - start) * 1000
+
+        # Big schemes are written less often, so that writing them takes
+        # at most a fifth of the time.
+        delay = max(self.write_delay, int(self.write_cost * 4))
+        self.write_pending = True
+        sublime.set_timeout(flush, delay)
+
     def write_color_scheme(self, rules):
+        stats = ColorPainterViewsManager.stats
         profile.scheme_data["rules"] = rules
-        with open(self.abspath, "w") as file:
-            file.write(json.dumps(profile.scheme_data))
+        content = json.dumps(profile.scheme_data).encode("utf-8")
+        digest = hashlib.md5(content).hexdigest()
+        stats.count("scheme_rules", n=len(rules))
+        if digest == self.digest:
+            stats.count("scheme_skips")
+            Loger.print("write_color_scheme: unchanged, skipped")
+            return
+
+        # Write a sibling file and rename it over the scheme, so sublime
+        # never reloads a half-written file.
+        temppath = self.abspath + ".tmp"
+        with open(temppath, "wb") as file:
+            file.write(content)
+        os.replace(temppath, self.abspath)
+        self.digest = digest
+        stats.count("scheme_writes")
+        stats.count("scheme_bytes", n=len(content))
 
         entry = ["write_color_scheme:", self.abspath]
         Loger.print("\n\t".join(entry))
 
 
+class RepaintScheduler(object):
+    # Milliseconds spent painting views in one batch, and between batches,
+    # which leaves the main thread to the editor in the meantime.
+    time_slice = 20
+    batch_delay = 10
+
+    def __init__(self):
+        self.queue = []
+        self.running = False
+
+    def priority(self, view, window, visible):
+        # The active view first, then the other views shown in the groups
+        # of each window, then background tabs.
+        if view.view_id in visible:
+            if (window == sublime.active_window() and
+                    view == window.active_view()):
+                return 0
+            return 1
+        return 2
+
+    def schedule(self, windows, wanted=None):
+        # Queue the views of the windows, or those of them wanted.
+        queue = []
+        for window in windows:
+            visible = set()
+            for group in range(window.num_groups()):
+                view = window.active_view_in_group(group)
+                if view is not None:
+                    visible.add(view.view_id)
+            for view in window.views():
+                if wanted is None or wanted(view):
+                    queue.append((self.priority(view, window, visible),
+                                  len(queue), view))
+        # Popped from the end.
+        queue.sort(reverse=True)
+        self.queue = [view for priority, i, view in queue]
+        if not self.running:
+            self.running = True
+            sublime.set_timeout(self.run)
+
+    def clear(self):
+        # A pending run finds nothing left to paint and stops.
+        self.queue = []
+
+    def take(self, view):
+        # Remove the view from the queue, to paint it right away.
+        for i, queued in enumerate(self.queue):
+            if queued.view_id == view.view_id:
+                del self.queue[i]
+                return True
+        return False
+
+    def run(self):
+        deadline = time.perf_counter() + self.time_slice / 1000
+        while self.queue:
+            view = self.queue.pop()
+            if view.is_valid():
+                ColorPainterViewsManager.repaint_view(view)
+            if time.perf_counter() >= deadline:
+                break
+        if self.queue:
+            sublime.set_timeout(self.run, self.batch_delay)
+        else:
+            self.running = False
+
+
+class ColorRegistry(object):
+    def __init__(self):
+        # color -> [number, reference count]
+        self.colors = {}
+        self.color_number = 0
+        # bumped whenever a color is added or pruned
+        self.version = 0
+
+    def acquire(self, color):
+        if color not in self.colors:
+            self.colors[color] = [self.color_number, 0]
+            self.color_number += 1
+            self.version += 1
+        entry = self.colors[color]
+        entry[1] += 1
+        return self.scope(entry[0])
+
+    def release(self, color):
+        # The color keeps its number and its rules until the scheme is
+        # written again, so one coming back meanwhile, like when its text
+        # is edited, needs no new rules.
+        entry = self.colors.get(color)
+        if entry is not None:
+            entry[1] -= 1
+
+    def prune(self):
+        # Drop the colors released by every view.
+        released = [color for color, (number, count) in self.colors.items()
+                    if count <= 0]
+        for color in released:
+            del self.colors[color]
+        if released:
+            self.version += 1
+            if not self.colors:
+                self.color_number = 0
+
+    def scope(self, number):
+        return "painter_color_" + str(number)
+
+    def number_of(self, color):
+        return self.colors[color][0]
+
+    def scope_of(self, color):
+        return self.scope(self.colors[color][0])
+
+    def scheme_rules(self, make_rule_full_text, make_rule_selection):
+        rules_full_text, rules_selection = [], []
+        for color, (number, count) in self.colors.items():
+            scope = self.scope(number)
+            scope_s = scope + "s"
+            rules_full_text.append(make_rule_full_text(scope, scope, color))
+            rules_selection.append(make_rule_selection(scope_s, scope_s, color))
+        return rules_full_text + rules_selection
+
+
+def timed(phase):
+    def decorator(method):
+        def timed_method(self, *args):
+            stats = ColorPainterViewsManager.stats
+            with stats.timer(phase, self.view.view_id):
+                return method(self, *args)
+        return timed_method
+    return decorator
+
+
+def merge_regions(regions):
+    merged = []
+    for region in sorted(regions, key=lambda r: r.begin()):
+        if merged and region.begin() <= merged[-1].end():
+            if region.end() > merged[-1].end():
+                merged[-1] = sublime.Region(merged[-1].begin(), region.end())
+        else:
+            merged.append(sublime.Region(region.begin(), region.end()))
+    return merged
+
+
+def subtract_regions(region, covered):
+    uncovered = []
+    begin = region.begin()
+    for r in covered:
+        if r.end() <= begin:
+            continue
+        if r.begin() >= region.end():
+            break
+        if r.begin() > begin:
+            uncovered.append(sublime.Region(begin, r.begin()))
+        begin = max(begin, r.end())
+    if begin < region.end():
+        uncovered.append(sublime.Region(begin, region.end()))
+    return uncovered
+
+
+def regions_apart(regions, windows):
+    # The sorted regions which neither overlap nor touch any of the merged
+    # windows, found by bisecting.
+    apart = []
+    pos = 0
+    for window in windows:
+        i = bisect.bisect_left(regions, sublime.Region(window.begin()), pos)
+        while i > pos and regions[i - 1].end() >= window.begin():
+            i -= 1
+        j = bisect.bisect_left(regions, sublime.Region(window.end() + 1), i)
+        apart.extend(regions[pos:i])
+        pos = j
+    apart.extend(regions[pos:])
+    return apart
+
+
+def toggled_regions(regions, others):
+    # The parts covered by only one of two lists of merged regions, as
+    # coverage flips at each bound of either.
+    bounds = sorted(itertools.chain.from_iterable(
+        (r.begin(), r.end()) for r in itertools.chain(regions, others)))
+    return [sublime.Region(a, b)
+            for a, b in zip(bounds[::2], bounds[1::2]) if a < b]
+
+
 class ColorPainterViewEventListener(object):
-    def __init__(self, view, color_modes):
+    # Characters painted around the visible region in lazy mode.
+    lazy_painting_margin = 10000
+    # Milliseconds between two viewport checks in lazy mode.
+    viewport_poll_delay = 250
+    # Characters scanned by one task of the async worker at first. It is
+    # adapted to the time the tasks take, within the given bounds.
+    scan_chunk_size = 65536
+    min_scan_chunk_size = 4096
+    max_scan_chunk_size = 1048576
+    # Milliseconds one task may take, on the main thread or the async
+    # worker, before the rest of its work is cut smaller or deferred.
+    time_budget = 10
+    # Colors of a scan cache entry added between two checks of the time
+    # budget.
+    load_batch_size = 1024
+    # Milliseconds to gather the colors of several scanned chunks before
+    # submitting their regions.
+    flush_delay = 50
+    # Milliseconds to gather selection changes, such as those of a held
+    # arrow key, into one update.
+    selection_delay = 10
+    # With a selector, scans of fewer characters check the scope of each
+    # color found instead of looking for all the text matching it.
+    selector_lookup_size = 65536
+    # Milliseconds after an edit before looking for the text whose scope
+    # it changed away from it, such as a block commented out.
+    scope_check_delay = 500
+
+    def __init__(self, view, color_modes, selector=""):
         self.view = view
+        # only the text matching this selector is scanned, if any
+        self.selector = selector
+        # (change count, begins, ends) of the text matching the selector
+        self.scoped_regions = None
         no = str(view.view_id)
         self.key_prefix = "painter" + no + "_"
-        self.color_number = 0
+        self.painted_key = self.key_prefix + "painted"
+        # the text matching the selector when it was last looked up
+        self.scoped_key = self.key_prefix + "scoped"
+        # the text rescanned after edits since the last flush
+        self.edited_key = self.key_prefix + "edited"
+        self.buffer_id = view.buffer_id()
+        # The listener scanning the buffer, whose spans and color counts
+        # are shared with the clone views of it, which only paint them.
+        self.source = self
+        self.clones = []
+        self.lazy = False
+        self.generation = 0
+        # generation of the scan cache entry being loaded, if any
+        self.loading_generation = None
+        self.visible_region = None
+        self.viewport_polling = False
+        self.selection_pending = False
         self.selection_points = []
-        self.keys_selection = {}
-        self.keys_full_text = {}
-        self.scheme_rules_full_text = []
-        self.scheme_rules_selection = []
+        # begin -> color of the colors under a caret
+        self.selection = {}
+        self.spans = ColorSpans()
+        # color -> number of its occurrences in this view
+        self.color_counts = {}
+        # colors holding a reference in the registry
+        self.acquired_colors = set()
+        # colors whose regions have to be submitted again
+        self.dirty_colors = set()
+        # colors whose regions are up to date but in the edited text
+        self.patched_colors = set()
+        self.flush_pending = False
+        self.scope_check_pending = False
+        # milliseconds taken by the last flush
+        self.flush_cost = 0.0
+        # colors with a non-empty selection key
+        self.selected_colors = set()
+        # key of the scan cache entry matching the colors painted
+        self.cached_key = None
+        # change count of the view when it was hibernated, if its spans
+        # are still those of the text
+        self.hibernated_change_count = None
         self.get_color_regexs(color_modes)
 
     def get_color_regexs(self, color_modes):
-        regexs = []
-        for mode in color_modes:
-            if mode in profile.color_regexs:
-                regex = profile.color_regexs[mode]
-                regexs.append(regex)
+        self.matcher = ColorMatcher.get(color_modes)
+        self.regex = self.matcher.regex
 
-        regex = r"(" + "|".join(regexs) + r")"
-        self.regex = re.compile(regex)
-
-    def change_color_modes(self, color_modes):
+    def change_color_modes(self, color_modes, selector=""):
+        # Only the colors of removed modes are erased, and only the new
+        # modes are looked for, unless the selector changed.
+        old_modes = set(self.matcher.color_modes)
         self.get_color_regexs(color_modes)
-        self.reload()
-
-    def rebuild_scheme_rules(self, bg_full_text, bg_selection):
-        filename = self.view.file_name() or "untitled"
-        entry = ["rebuild color scheme...", filename]
-        Loger.print("\n\t".join(entry))
-
-        # TODO: make colors displayed more clearly.
-        for rule in self.scheme_rules_full_text:
-            rule["background"] = bg_full_text
-            pass
-        for rule in self.scheme_rules_selection:
-            rule["background"] = bg_selection
-            pass
+        if selector != self.selector:
+            self.selector = selector
+            self.scoped_regions = None
+            self.reload()
+            return
+        new_modes = set(self.matcher.color_modes)
+        if new_modes == old_modes:
+            return
+        # Scans under way look for the old modes.
+        self.generation += 1
+        if old_modes - new_modes:
+            self.drop_color_modes(old_modes - new_modes)
+        if new_modes - old_modes:
+            self.scan_color_modes(new_modes - old_modes)
+        else:
+            self.resume_painting()
+
+    def drop_color_modes(self, color_modes):
+        # Colors are told apart by their text, which is read a chunk at a
+        # time rather than once per color.
+        dropped = []
+        window_begin, window = 0, ""
+        for i, (begin, end, color) in enumerate(self.spans):
+            if end > window_begin + len(window):
+                window_begin = begin
+                window = self.view.substr(sublime.Region(
+                    begin, max(end, begin + self.scan_chunk_size)))
+            text = window[begin - window_begin:end - window_begin]
+            if color_mode_of(text) in color_modes:
+                dropped.append(i)
+        if dropped:
+            self.erase_spans(self.spans.remove_all(dropped))
+            self.refresh_selection()
+            self.flush_colors()
+        self.save_scan()
+
+    def scan_color_modes(self, color_modes):
+        # Look for the colors of the new modes in the text painted so far,
+        # which is unmarked until then, so if the scan is dropped the text
+        # is scanned again for all the modes. The rest of the text is
+        # scanned for all the modes when it is painted.
+        painted = self.view.get_regions(self.painted_key)
+        if painted:
+            self.unmark_painted(painted)
+            self.paint_regions(painted, ColorMatcher.get(color_modes).regex)
+        else:
+            self.resume_painting()
 
     def change_gutter_icon(self, gutter_icon):
-        style = ColorPainterViewsManager.style_full_text
-        for row in self.keys_full_text:
-            for key in self.keys_full_text[row]:
-                regions = self.view.get_regions(key)
-                self.view.erase_regions(key)
-                self.view.add_regions(key, regions,
-                    scope=key,
-                    icon=gutter_icon,
-                    flags=style)
+        self.dirty_colors.update(self.acquired_colors)
+        self.flush_colors()
 
     def reload(self):
         self.clear_all()
         self.on_load()
 
-    def clear_selection(self):
-        Loger.print("erase selection:", self.keys_selection)
+    def follow(self, source):
+        # Paint the colors found in another view of the buffer.
+        self.source = source
+        self.spans = source.spans
+        self.color_counts = source.color_counts
+        self.lazy = source.lazy
+        source.clones.append(self)
+        painted = source.view.get_regions(source.painted_key)
+        self.add_regions(self.painted_key, painted, flags=sublime.HIDDEN)
+        self.dirty_colors.update(
+            color for color, count in self.color_counts.items() if count)
+        self.refresh_selection()
+        self.flush_colors()
+        if self.lazy:
+            self.paint_visible()
+            self.poll_viewport()
+
+    def unfollow(self):
+        # Stop sharing colors with the other views of the buffer, which
+        # keep them; a clone takes over the scans of a source.
+        if self.source is self:
+            if not self.clones:
+                return
+            heir = self.clones[0]
+            heir.source = heir
+            heir.clones = self.clones[1:]
+            for clone in heir.clones:
+                clone.source = heir
+            heir.cached_key = self.cached_key
+            heir.scan_chunk_size = self.scan_chunk_size
+            self.clones = []
+            self.generation += 1
+            heir.track_scopes()
+            heir.resume_painting()
+        else:
+            self.source.clones.remove(self)
+            self.source = self
+        self.spans = ColorSpans()
+        self.color_counts = {}
+
+    def add_regions(self, key, regions, **kwargs):
+        stats = ColorPainterViewsManager.stats
+        stats.count("add_regions", self.view.view_id)
+        self.view.add_regions(key, regions, **kwargs)
+
+    def erase_regions(self, key):
+        stats = ColorPainterViewsManager.stats
+        stats.count("erase_regions", self.view.view_id)
+        self.view.erase_regions(key)
+
+    def color_key(self, color):
+        registry = ColorPainterViewsManager.color_registry
+        return self.key_prefix + str(registry.number_of(color))
+
+    @timed("flush")
+    def flush_colors(self, flipped=()):
+        # Submit all the regions of each dirty color in one call, split
+        # between its full text key and its selection key. The colors just
+        # put under or taken off a caret, or only changed in the text
+        # rescanned after edits, are otherwise up to date, so their painted
+        # regions are patched and split again rather than walking all the
+        # spans of colors found all over the text.
+        dirty_colors = self.dirty_colors
+        patched = self.patched_colors.union(flipped)
+        dirty_colors.update(color for color in patched
+                            if color not in self.acquired_colors)
+        for clone in self.clones:
+            clone.dirty_colors.update(dirty_colors)
+            clone.refresh_selection()
+            clone.flush_colors()
+        windows = []
+        if self.patched_colors:
+            self.patched_colors = set()
+            windows = self.view.get_regions(self.edited_key)
+            self.erase_regions(self.edited_key)
+        patched = [color for color in patched if color not in dirty_colors]
+        if not dirty_colors and not patched:
+            return
+        self.dirty_colors = set()
+        start = time.perf_counter()
+
+        groups = self.spans.group(dirty_colors)
+        full_text = {color: [] for color in groups}
+        selection = {color: [] for color in groups}
+        for color, spans in groups.items():
+            for begin, end in spans:
+                region = sublime.Region(begin, end)
+                if self.selection.get(begin) == color:
+                    selection[color].append(region)
+                else:
+                    full_text[color].append(region)
+        edited = {}
+        if patched:
+            for window in windows:
+                for begin, end, color in self.spans.find_range(
+                        window.begin(), window.end()):
+                    edited.setdefault(color, set()).add((begin, end))
+        for color in patched:
+            full_text[color], selection[color] = [], []
+            if self.color_counts.get(color):
+                full_text[color], selection[color] = self.patch_regions(
+                    color, windows, edited.get(color, ()))
+
+        registry = ColorPainterViewsManager.color_registry
+        gutter_icon = ColorPainterViewsManager.gutter_icon
+        style_full_text = ColorPainterViewsManager.style_full_text
+        style_selection = ColorPainterViewsManager.style_selection
+        version = registry.version
+        for color in sorted(full_text):
+            if not self.color_counts.get(color):
+                self.color_counts.pop(color, None)
+                if color in self.acquired_colors:
+                    key = self.color_key(color)
+                    self.erase_regions(key)
+                    self.erase_regions(key + "s")
+                    self.acquired_colors.remove(color)
+                    self.selected_colors.discard(color)
+                    registry.release(color)
+                continue
+            if color not in self.acquired_colors:
+                self.acquired_colors.add(color)
+                registry.acquire(color)
+            key = self.color_key(color)
+            scope = registry.scope_of(color)
+            if full_text[color]:
+                self.add_regions(key, full_text[color],
+                    scope=scope,
+                    icon=gutter_icon,
+                    flags=style_full_text)
+            else:
+                self.erase_regions(key)
+            if selection[color]:
+                self.selected_colors.add(color)
+                self.add_regions(key + "s", selection[color],
+                    scope=scope + "s",
+                    icon=gutter_icon,
+                    flags=style_selection)
+            elif color in self.selected_colors:
+                self.selected_colors.remove(color)
+                self.erase_regions(key + "s")
+
+        if registry.version != version:
+            stats = ColorPainterViewsManager.stats
+            stats.count("scheme_changes", self.view.view_id)
+            ColorPainterViewsManager.write_scheme()
+        self.flush_cost = (time.perf_counter() - start) * 1000
+
+    def patch_regions(self, color, windows, spans):
+        # The painted regions of a color, with those in the windows
+        # replaced by its spans there, split again between the full text
+        # and the selection. The sorted lists of regions are cut and
+        # spliced rather than walked, as common colors have lots of them.
+        key = self.color_key(color)
+        full = regions_apart(self.view.get_regions(key), windows)
+        moved = regions_apart(self.view.get_regions(key + "s"), windows)
+        moved.extend(sublime.Region(begin, end) for begin, end in spans)
+        for begin, other in self.selection.items():
+            if other == color:
+                i = bisect.bisect_left(full, sublime.Region(begin))
+                if i < len(full) and full[i].begin() == begin:
+                    moved.append(full.pop(i))
+        selected = []
+        for region in moved:
+            if self.selection.get(region.begin()) == color:
+                selected.append(region)
+            else:
+                bisect.insort(full, region)
+        return full, sorted(selected)
 
-        for key in self.keys_selection:
-            self.view.erase_regions(key)
-        self.keys_selection = {}
-        self.scheme_rules_selection = []
+    def clear_selection(self):
+        Loger.print("erase selection:", self.selection)
+        self.dirty_colors.update(self.selection.values())
+        self.selection = {}
+        self.flush_colors()
 
-    def clear_all(self):
+    def clear_colors(self):
         self.clear_selection()
         self.selection_points = []
 
-        for row in self.keys_full_text:
-            for key in self.keys_full_text[row]:
-                self.view.erase_regions(key)
-        self.color_number = 0
-        self.keys_full_text = {}
-        self.scheme_rules_full_text = []
-
-    def get_new_colors_in_region(self, region):
-        key_regions = []
-        make_rule_full_text = ColorPainterViewsManager.make_rule_full_text
-        make_rule_selection = ColorPainterViewsManager.make_rule_selection
-        conten = self.view.substr(region)
-        b = region.begin()
-        for match in self.regex.finditer(conten):
-            l, r = match.span()
-            region = sublime.Region(l + b, r + b)
-            row, col = self.view.rowcol(region.a)
-            color = match.group()
-            key = self.key_prefix + str(self.color_number)
-            key_s = key + "s"
-            self.color_number += 1
-            rule_full_text = make_rule_full_text(key, key, color)
-            rule_selection = make_rule_selection(key_s, key_s, color)
-            self.scheme_rules_full_text.append(rule_full_text)
-            self.scheme_rules_selection.append(rule_selection)
+        registry = ColorPainterViewsManager.color_registry
+        # The selection keys are erased by clear_selection.
+        for color in self.acquired_colors:
+            self.erase_regions(self.color_key(color))
+            registry.release(color)
+        self.visible_region = None
+        self.acquired_colors = set()
+        self.dirty_colors = set()
+        self.patched_colors = set()
+        self.erase_regions(self.edited_key)
+        self.selected_colors = set()
 
-            key_regions.append((key, [region]))
-            if row not in self.keys_full_text:
-                self.keys_full_text[row] = []
-            self.keys_full_text[row].append(key)
+    def clear_all(self):
+        self.generation += 1
+        for listener in [self] + self.clones:
+            listener.clear_colors()
+        self.set_painted([])
+        self.cached_key = None
+        self.spans.clear()
+        self.color_counts.clear()
+
+    def hibernate(self):
+        # Give back the regions and the scheme rules of the colors, but
+        # keep the spans and the painted regions to paint them again,
+        # unless they are shared with other views.
+        shared = self.source is not self or self.clones
+        self.unfollow()
+        self.generation += 1
+        registry = ColorPainterViewsManager.color_registry
+        for color in self.acquired_colors:
+            key = self.color_key(color)
+            self.erase_regions(key)
+            if color in self.selected_colors:
+                self.erase_regions(key + "s")
+            registry.release(color)
+        self.selection = {}
+        self.selection_points = []
+        self.visible_region = None
+        self.color_counts.clear()
+        self.acquired_colors = set()
+        self.dirty_colors = set()
+        self.patched_colors = set()
+        self.erase_regions(self.edited_key)
+        self.selected_colors = set()
+        if shared:
+            self.hibernated_change_count = None
+        else:
+            self.hibernated_change_count = self.view.change_count()
 
-        return key_regions
+    def wake(self):
+        if self.hibernated_change_count != self.view.change_count():
+            # Edited, or never painted.
+            self.reload()
+            return
+        self.hibernated_change_count = None
+        self.color_counts.update(self.spans.counts())
+        self.dirty_colors.update(self.color_counts)
+        self.refresh_selection()
+        self.flush_colors()
+        # Go on with painting what was left.
+        self.start_painting()
+
+    def schedule_flush(self):
+        if self.flush_pending:
+            return
 
-    def paint_regions(self, regions):
-        key_regions = []
+        def flush():
+            self.flush_pending = False
+            view_id = self.view.view_id
+            if ColorPainterViewsManager.painted_views.get(view_id) is self:
+                # New colors may lie under the carets.
+                self.refresh_selection()
+                self.flush_colors()
+
+        self.flush_pending = True
+        sublime.set_timeout(flush, self.flush_delay)
+
+    def erase_spans(self, spans):
+        for begin, end, color in spans:
+            self.color_counts[color] -= 1
+            self.dirty_colors.add(color)
+
+    def erase_colors(self, regions):
+        # Erase the colors touching the regions, and return the regions
+        # grown to cover them, so rescanning them finds those colors again.
+        erased = list(regions)
         for region in regions:
-            key_regions.extend(self.get_new_colors_in_region(region))
-        if len(key_regions) > 0:
-            ColorPainterViewsManager.write_scheme()
-            gutter_icon = ColorPainterViewsManager.gutter_icon
-            style = ColorPainterViewsManager.style_full_text
-            for key, regions in key_regions:
-                self.view.add_regions(key, regions,
-                    scope=key,
-                    icon=gutter_icon,
-                    flags=style)
+            spans = self.spans.remove(region.begin(), region.end())
+            self.erase_spans(spans)
+            if spans:
+                erased.append(sublime.Region(spans[0][0], spans[-1][1]))
+        regions = merge_regions(erased)
+        self.unmark_painted(regions)
+        return regions
+
+    def scan_chunks(self, regions, regex=None):
+        # Runs on the async worker. Each chunk is read with one character
+        # before it and a color after it, so word boundaries are seen as in
+        # the whole text and colors may end past it; only colors starting
+        # inside it are kept. Chunks are cut at the last line end of the
+        # text already read, instead of asking sublime where lines end.
+        # Colors are normalized here too, so equal colors spelled
+        # differently share their regions and scheme rules.
+        size = self.view.size()
+        margin = MAX_COLOR_LENGTH
+        selector = self.selector
+        scoped = None
+        if selector:
+            if sum(r.size() for r in regions) > self.selector_lookup_size:
+                scoped = self.find_scoped()
+        for region in regions:
+            begin, end = region.begin(), region.end()
+            while begin < end:
+                stop = min(begin + self.scan_chunk_size, end)
+                left = max(0, begin - 1)
+                right = min(size, stop + margin)
+                conten = self.view.substr(sublime.Region(left, right))
+                if stop < end:
+                    cut = conten.rfind("\n", begin - left, stop - left)
+                    if cut >= 0:
+                        stop = left + cut + 1
+                if scoped is None:
+                    windows = [(begin, right)]
+                else:
+                    windows = self.scoped_windows(scoped, begin, stop, right)
+                check = selector and scoped is None
+                pattern = regex or self.regex
+                matches = []
+                for a, b in windows:
+                    for match in pattern.finditer(
+                            conten, a - left, b - left):
+                        l, r = match.span()
+                        l, r = l + left, r + left
+                        if l >= stop:
+                            break
+                        if check and not self.view.match_selector(l, selector):
+                            continue
+                        matches.append((l, r, match.group()))
+                yield sublime.Region(begin, stop), normalize_spans(matches)
+                begin = stop
+
+    def find_scoped(self):
+        # The text matching the selector, looked up once per change.
+        change_count = self.view.change_count()
+        if (self.scoped_regions is None or
+                self.scoped_regions[0] != change_count):
+            regions = merge_regions(self.view.find_by_selector(self.selector))
+            self.scoped_regions = (change_count,
+                                   [r.begin() for r in regions],
+                                   [r.end() for r in regions])
+        return self.scoped_regions
+
+    def scoped_windows(self, scoped, begin, stop, right):
+        # The parts of [begin, right] matching the selector, for colors
+        # starting before stop.
+        change_count, begins, ends = scoped
+        windows = []
+        i = bisect.bisect_right(ends, begin)
+        while i < len(begins) and begins[i] < stop:
+            windows.append((max(begins[i], begin), min(ends[i], right)))
+            i += 1
+        return windows
+
+    def track_scopes(self):
+        # The text matching the selector is kept as hidden regions, which
+        # sublime moves along with the text, to be told from the text
+        # matching it after edits.
+        if not self.selector:
+            self.erase_regions(self.scoped_key)
+            return []
+        change_count, begins, ends = self.find_scoped()
+        regions = [sublime.Region(a, b) for a, b in zip(begins, ends)]
+        self.add_regions(self.scoped_key, regions, flags=sublime.HIDDEN)
+        return regions
+
+    def schedule_scope_check(self):
+        if self.scope_check_pending:
+            return
+
+        def check():
+            self.scope_check_pending = False
+            view_id = self.view.view_id
+            if (ColorPainterViewsManager.painted_views.get(view_id) is self
+                    and self.source is self and self.selector):
+                self.check_scopes()
+
+        self.scope_check_pending = True
+        sublime.set_timeout(check, self.scope_check_delay)
+
+    def check_scopes(self):
+        # Edits rescan the text around them only, but may change the
+        # scope of text far away, like opening a comment. The colors of
+        # the text which started or stopped matching the selector are
+        # looked for again.
+        scoped = self.view.get_regions(self.scoped_key)
+        changed = toggled_regions(scoped, self.track_scopes())
+        if changed:
+            Loger.print("scopes changed:", changed)
+            self.erase_colors(changed)
+            self.schedule_flush()
+            self.resume_painting()
+
+    def rescan(self, regions):
+        # Scan the regions on the main thread, and return them grown to
+        # cover the colors erased.
+        stats = ColorPainterViewsManager.stats
+        view_id = self.view.view_id
+        regions = self.erase_colors(regions)
+        with stats.timer("scan", view_id):
+            for chunk, matches in self.scan_chunks(regions):
+                stats.count("chars_scanned", view_id, chunk.size())
+                stats.count("colors_found", view_id, len(matches))
+                self.add_colors(matches)
+                self.mark_painted([chunk])
+        return regions
+
+    def add_colors(self, matches):
+        for begin, end, color in self.spans.insert(matches):
+            self.color_counts[color] = self.color_counts.get(color, 0) + 1
+            self.dirty_colors.add(color)
+
+    def paint_regions(self, regions, regex=None):
+        # Regexs run on the async worker, one chunk per task, and only
+        # adding the colors happens on the main thread. Edits, clears and
+        # newer scans bump the generation, which drops this scan; what it
+        # did not paint yet stays unmarked and is picked up again later.
+        # A regex other than the view's one scans for some modes only.
+        self.generation += 1
+        generation = self.generation
+        change_count = self.view.change_count()
+        chunks = self.scan_chunks(regions, regex)
+        stats = ColorPainterViewsManager.stats
+        view_id = self.view.view_id
+
+        def stale():
+            return (generation != self.generation or
+                    change_count != self.view.change_count())
+
+        def apply(chunk, matches):
+            if stale():
+                return
+            start = time.perf_counter()
+            with stats.timer("apply", view_id):
+                if matches:
+                    self.add_colors(matches)
+                    self.schedule_flush()
+                self.mark_painted([chunk])
+            self.adapt_chunk_size(chunk, start)
+
+        def finish():
+            if not stale():
+                self.save_scan()
+                if regex is not None:
+                    # Go on with the scan this one may have dropped.
+                    self.resume_painting()
+
+        def scan():
+            if stale():
+                return
+            start = time.perf_counter()
+            with stats.timer("scan", view_id):
+                scanned = next(chunks, None)
+            if scanned is None:
+                sublime.set_timeout(finish)
+                return
+            self.adapt_chunk_size(scanned[0], start)
+            stats.count("chars_scanned", view_id, scanned[0].size())
+            stats.count("colors_found", view_id, len(scanned[1]))
+            sublime.set_timeout(lambda: apply(*scanned))
+            sublime.set_timeout_async(scan)
+
+        sublime.set_timeout_async(scan)
+
+    def adapt_chunk_size(self, chunk, start):
+        # Keep scanning and applying one chunk within the time budget,
+        # whatever the density of colors or the length of lines is.
+        # Chunks cut short by the end of a region tell little.
+        ms = (time.perf_counter() - start) * 1000
+        size = chunk.size()
+        if size < self.scan_chunk_size // 2:
+            return
+        if ms > self.time_budget:
+            self.scan_chunk_size = max(self.min_scan_chunk_size, size // 2)
+        elif ms < self.time_budget / 4:
+            self.scan_chunk_size = min(self.max_scan_chunk_size, size * 2)
+
+    def scan_cache_key(self):
+        cache = ColorPainterViewsManager.scan_cache
+        filename = self.view.file_name()
+        if cache is None or not filename or self.view.is_dirty():
+            return None
+        return cache.key(filename, self.matcher.color_modes, self.selector)
+
+    def load_scan(self):
+        # Paint the colors found when the file was scanned last time, if
+        # it has not changed since, and tell whether they are looked for.
+        # The entry is read on the async worker, and its colors are added
+        # like those of a scan, as many as fit in the time budget at once,
+        # the ones of the paint target first. Without an entry the view is
+        # painted as usual.
+        key = self.scan_cache_key()
+        if key is None:
+            return False
+        self.generation += 1
+        generation = self.loading_generation = self.generation
+        change_count = self.view.change_count()
+        cache = ColorPainterViewsManager.scan_cache
+        stats = ColorPainterViewsManager.stats
+        view_id = self.view.view_id
+
+        def stale():
+            return (generation != self.generation or
+                    change_count != self.view.change_count())
+
+        def apply(spans, ranges):
+            if stale():
+                return
+            start = time.perf_counter()
+            with stats.timer("apply", view_id):
+                while (ranges and (time.perf_counter() - start) * 1000 <
+                       self.time_budget):
+                    begin, end = ranges[0]
+                    i = bisect.bisect_left(spans, (begin,))
+                    j = min(bisect.bisect_left(spans, (end,), i),
+                            i + self.load_batch_size)
+                    if j < len(spans) and spans[j][0] < end:
+                        ranges[0] = (spans[j][0], end)
+                        end = spans[j][0]
+                    else:
+                        ranges.pop(0)
+                    self.add_colors(spans[i:j])
+                    self.mark_painted([sublime.Region(begin, end)])
+                self.schedule_flush()
+            if ranges:
+                sublime.set_timeout(lambda: apply(spans, ranges))
+                return
+            self.loading_generation = None
+            if self.lazy:
+                self.poll_viewport()
+
+        def loaded(spans):
+            if stale():
+                return
+            if spans is None:
+                self.loading_generation = None
+                stats.count("scan_cache_misses", view_id)
+                self.start_painting()
+                return
+            stats.count("scan_cache_hits", view_id)
+            self.cached_key = key
+            target = self.paint_target()
+            ranges = [(target.begin(), target.end()),
+                      (0, target.begin()),
+                      (target.end(), self.view.size())]
+            apply(spans, [(a, b) for a, b in ranges if a < b])
+
+        def read():
+            spans = cache.get(key)
+            sublime.set_timeout(lambda: loaded(spans))
+
+        sublime.set_timeout_async(read)
+        return True
+
+    def save_scan(self):
+        key = self.scan_cache_key()
+        if key is None or key == self.cached_key or not self.fully_painted():
+            return
+        self.cached_key = key
+        cache = ColorPainterViewsManager.scan_cache
+        # Arrays take a fraction of the memory of a list of tuples.
+        spans = self.spans.copy()
+        sublime.set_timeout_async(lambda: cache.put(key, spans))
+
+    def paint_target(self):
+        if not self.lazy:
+            return sublime.Region(0, self.view.size())
+        visible = self.view.visible_region()
+        margin = self.lazy_painting_margin
+        begin = max(0, visible.begin() - margin)
+        end = min(self.view.size(), visible.end() + margin)
+        # Whole lines only when they are short: a minified file can be a
+        # single line, and scan_chunks reads past both ends anyway.
+        first = self.view.line(begin)
+        if begin - first.begin() <= margin:
+            begin = first.begin()
+        last = self.view.line(end)
+        if last.end() - end <= margin:
+            end = last.end()
+        return sublime.Region(begin, end)
+
+    def resume_painting(self):
+        painted = self.view.get_regions(self.painted_key)
+        uncovered = []
+        for listener in [self] + self.clones:
+            uncovered.extend(
+                subtract_regions(listener.paint_target(), painted))
+        uncovered = merge_regions(uncovered)
+        if uncovered:
+            regions = self.erase_colors(uncovered)
+            # The colors found again by the scan need not be submitted
+            # twice.
+            self.schedule_flush()
+            Loger.print("paint:", regions)
+            self.paint_regions(regions)
 
     def paint_full_text(self):
-        region = sublime.Region(0, self.view.size())
-        self.paint_regions([region])
+        self.resume_painting()
+
+    def mark_painted(self, regions):
+        # The painted ranges are kept as hidden regions, so sublime
+        # shifts them along with the text on every edit.
+        painted = self.view.get_regions(self.painted_key)
+        self.set_painted(merge_regions(painted + regions))
+
+    def unmark_painted(self, regions):
+        painted = self.view.get_regions(self.painted_key)
+        regions = merge_regions(regions)
+        unpainted = []
+        for region in painted:
+            unpainted.extend(subtract_regions(region, regions))
+        self.set_painted(unpainted)
+
+    def set_painted(self, painted):
+        # Clones keep a copy, to take over the scans of the buffer.
+        for listener in [self] + self.clones:
+            listener.add_regions(listener.painted_key, painted,
+                flags=sublime.HIDDEN)
+
+    def fully_painted(self):
+        painted = self.view.get_regions(self.painted_key)
+        return (len(painted) == 1 and painted[0].begin() == 0 and
+                painted[0].end() >= self.view.size())
+
+    def paint_visible(self):
+        source = self.source
+        if source.loading_generation == source.generation:
+            # The scan cache entry paints the rest.
+            return
+        visible = self.view.visible_region()
+        if visible == self.visible_region:
+            return
+        self.visible_region = visible
+        self.source.resume_painting()
+
+    def poll_viewport(self):
+        if self.viewport_polling:
+            return
 
+        def poll():
+            self.viewport_polling = False
+            view_id = self.view.view_id
+            if (not self.lazy or not self.view.is_valid() or
+                    ColorPainterViewsManager.painted_views.get(view_id) is not self):
+                return
+            self.paint_visible()
+            # Background views are polled again once they are activated.
+            window = self.view.window()
+            if (window and window.active_view() == self.view and
+                    not self.fully_painted()):
+                self.poll_viewport()
+
+        self.viewport_polling = True
+        sublime.set_timeout(poll, self.viewport_poll_delay)
+
+    def refresh_selection(self):
+        style_selection = ColorPainterViewsManager.style_selection
+        if style_selection != ColorPainterViewsManager.style_full_text:
+            self.selection_points = []
+            self.paint_selection()
+
+    @timed("selection")
     def paint_selection(self):
-        points = [s.a for s in self.view.sel()]
+        points = sorted(s.a for s in self.view.sel())
         if points == self.selection_points:
             return
         self.selection_points = points
 
-        new_selection = {}
-        gutter_icon = ColorPainterViewsManager.gutter_icon
-        style = ColorPainterViewsManager.style_selection
-        for pt in points:
-            row, col = self.view.rowcol(pt)
-            if row in self.keys_full_text:
-                for key in self.keys_full_text[row]:
-                    regions = self.view.get_regions(key)
-                    key_s = key + "s"
-                    if not regions:
-                        regions = self.view.get_regions(key_s)
-                    if regions and regions[0].a <= pt and regions[0].b >= pt:
-                        color = self.view.substr(regions[0])
-                        new_selection[key_s] = color
-                        if key_s not in self.keys_selection:
-                            Loger.print("new selection:", key_s, color)
-                            self.view.erase_regions(key)
-                            self.view.add_regions(key_s, regions,
-                                scope=key_s,
-                                icon=gutter_icon,
-                                flags=style)
-                        break
-
-        style = ColorPainterViewsManager.style_full_text
-        for key in self.keys_selection:
-            if key not in new_selection:
-                regions = self.view.get_regions(key)
-                self.view.erase_regions(key)
-                key = key[:-1]
-                self.view.add_regions(key, regions,
-                    scope=key,
-                    icon=gutter_icon,
-                    flags=style)
-        self.keys_selection = new_selection
-
-
-    def modified_regions(self):
-        rows = set()
-        for sel in self.view.sel():
-            row, col = self.view.rowcol(sel.a)
-            if row not in rows:
-                if row in self.keys_full_text:
-                    Loger.print("erase color by:", row)
-                    for key in self.keys_full_text.pop(row):
-                        # regions = self.view.get_regions(key + "s")
-                        self.view.erase_regions(key)
-                        self.view.erase_regions(key + "s")
-                rows.add(row)
-                yield self.view.line(sel.a)
+        selection = {}
+        for begin, end, color in self.spans.find_all(points):
+            selection[begin] = color
+
+        flipped = set()
+        for begin, color in self.selection.items():
+            if selection.get(begin) != color:
+                flipped.add(color)
+        for begin, color in selection.items():
+            if self.selection.get(begin) != color:
+                Loger.print("new selection:", color)
+                flipped.add(color)
+        self.selection = selection
+        self.flush_colors(flipped)
 
     def on_load(self):
-        self.paint_full_text()
+        threshold = ColorPainterViewsManager.lazy_painting_threshold
+        self.lazy = 0 < threshold < self.view.size()
+        for clone in self.clones:
+            clone.lazy = self.lazy
+        self.track_scopes()
+        if not self.load_scan():
+            self.start_painting()
+
+    def start_painting(self):
+        if self.lazy:
+            self.paint_visible()
+            self.poll_viewport()
+        else:
+            self.paint_full_text()
 
     def on_selection_modified(self):
-        self.paint_selection()
+        if self.selection_pending:
+            return
 
-    def on_modified(self):
-        # TODO: too much!
-        self.paint_regions(self.modified_regions())
-        # self.reload()
-        # self.on_selection_modified()
+        def update():
+            self.selection_pending = False
+            view_id = self.view.view_id
+            if ColorPainterViewsManager.painted_views.get(view_id) is self:
+                if self.lazy:
+                    self.paint_visible()
+                self.paint_selection()
+
+        self.selection_pending = True
+        sublime.set_timeout(update, self.selection_delay)
+
+    @timed("text_change")
+    def on_text_changed(self, changes):
+        # Drop scans of the old text before anything else.
+        self.generation += 1
+
+        # The colors changed around small edits are patched into their
+        # regions, see flush_colors; they are told from those dirty already.
+        dirty_colors, self.dirty_colors = self.dirty_colors, set()
+
+        # Changes come in order, each one at positions in the text left by
+        # the previous ones: move the earlier dirty ranges and the colors
+        # after the change along, and erase the colors it touches.
+        dirty = []
+        erased = []
+        for change in changes:
+            begin, end = change.a.pt, change.b.pt
+            size = len(change.str)
+            delta = size - (end - begin)
+
+            def shift(pt):
+                if pt <= begin:
+                    return pt
+                if pt >= end:
+                    return pt + delta
+                return begin + size
+
+            dirty = [(shift(a), shift(b)) for a, b in dirty]
+            dirty.append((begin, begin + size))
+
+            removed = self.spans.remove(begin, end)
+            if removed:
+                # Even colors longer than the margin below.
+                dirty.append((shift(removed[0][0]), shift(removed[-1][1])))
+            erased.extend(removed)
+            self.spans.shift(end, delta)
+        self.erase_spans(erased)
+
+        # The offsets of the selected colors are out of date, but not
+        # their regions.
+        for listener in [self] + self.clones:
+            listener.patched_colors.update(listener.selection.values())
+            listener.selection = {}
+            listener.selection_points = []
+
+        # Widen each dirty range by the longest color, so colors made or
+        # broken by the edit at its edges are rescanned too. Small ones,
+        # as when typing, are rescanned right away, so the colors around
+        # them are replaced in the same flush they are erased in, rather
+        # than blinking until the scan comes.
+        size = self.view.size()
+        margin = MAX_COLOR_LENGTH
+        dirty = merge_regions([
+            sublime.Region(max(0, a - margin), min(size, b + margin))
+            for a, b in dirty])
+        if sum(r.size() for r in dirty) <= self.min_scan_chunk_size:
+            dirty = self.rescan(dirty)
+            if self.dirty_colors:
+                for listener in [self] + self.clones:
+                    listener.patched_colors.update(self.dirty_colors)
+                    edited = listener.view.get_regions(listener.edited_key)
+                    listener.add_regions(listener.edited_key,
+                        merge_regions(edited + dirty), flags=sublime.HIDDEN)
+            self.dirty_colors = dirty_colors
+        else:
+            self.unmark_painted(dirty)
+            self.dirty_colors.update(dirty_colors)
+        self.resume_painting()
+        if self.selector:
+            self.schedule_scope_check()
+        if self.flush_cost > self.time_budget:
+            # Sublime moves the regions along with the text, so they can
+            # wait for the typing to pause.
+            self.schedule_flush()
+        else:
+            self.refresh_selection()
+            self.flush_colors()
 
     def on_activated(self):
-        pass
+        if self.lazy:
+            self.paint_visible()
+            self.poll_viewport()
 
 
 class ColorPainterViewsManager(sublime_plugin.EventListener):
     ignored_views = {}
+    # in the order they were last activated
     painted_views = {}
+    # painted views whose colors were given back, until activated again
+    hibernated_views = {}
     color_modes = ["hex8", "hex6", "hex4", "hex3",
                     "hsl", "hsla", "rgb", "rgba", "css_named"]
     supported_color_modes = tuple(color_modes)
@@ -280,15 +1336,22 @@ class ColorPainterViewsManager(sublime_plugin.EventListener):
     supported_gutter_icons = {"", "dot", "circle", "bookmark"}
 
     color_scheme = ""
+    cswriters = {}
     file_types = []
-    syntax_specific = []
+    syntax_specific = {}
+    scope_selectors = {}
+    lazy_painting_threshold = 0
+    on_demand_painting_threshold = 0
+    hibernation_limit = 0
     style_full_text = profile.STYLE_FULL_TEXT
     style_selection = profile.STYLE_SELECTION
-    make_rule_full_text = None
-    make_rule_selection = None
+    color_registry = ColorRegistry()
+    stats = Stats()
+    scan_cache = None
+    scheduler = RepaintScheduler()
 
     @classmethod
-    def _paint_view(cls, view, color_modes):
+    def _paint_view(cls, view, color_modes, selector=""):
         if not color_modes:
             Loger.error(profile.error_color_modes_missing)
             return
@@ -296,21 +1359,43 @@ class ColorPainterViewsManager(sublime_plugin.EventListener):
         log = ["_paint_view:", filename, "+".join(color_modes)]
         Loger.print("\n\t".join(log))
 
-        view_listener = ColorPainterViewEventListener(view, color_modes)
+        cls.stats.view(view.view_id, filename)
+        view_listener = ColorPainterViewEventListener(
+            view, color_modes, selector)
+        if cls.is_cold(view):
+            # Painted once activated.
+            cls.hibernated_views[view.view_id] = view_listener
+            return
         cls.painted_views[view.view_id] = view_listener
-        cls.painted_views[view.view_id].on_load()
+        cls.start_painting(view_listener)
 
+    @classmethod
+    def find_source(cls, view_listener):
+        # A painted view of the same buffer, painted the same way.
+        for other in cls.painted_views.values():
+            if (other.source is other and other is not view_listener and
+                    other.buffer_id == view_listener.buffer_id and
+                    other.matcher is view_listener.matcher and
+                    other.selector == view_listener.selector):
+                return other
+        return None
 
     @classmethod
-    def _load_view(cls, view):
-        if view.view_id in cls.ignored_views:
-            view_listener = cls.ignored_views.pop(view.view_id)
-            cls.painted_views[view.view_id] = view_listener
-            cls.painted_views[view.view_id].on_load()
-            return
+    def start_painting(cls, view_listener):
+        # Clones of a painted view share its colors instead of scanning.
+        source = cls.find_source(view_listener)
+        if source is None:
+            view_listener.on_load()
+        else:
+            view_listener.follow(source)
 
+    @classmethod
+    def view_settings(cls, view):
+        # The color modes and selector of a view, or None if views like it
+        # are not painted.
         filename = view.file_name()
         color_modes = cls.color_modes
+        selector = ""
 
         if filename:
             name, ext = os.path.splitext(filename)
@@ -319,8 +1404,28 @@ class ColorPainterViewsManager(sublime_plugin.EventListener):
                 rmv = cls.syntax_specific[ext]
                 color_modes = [cm for cm in color_modes if cm not in rmv]
             elif ext not in cls.file_types:
+                return None
+            selector = cls.scope_selectors.get(ext, "")
+        return color_modes, selector
+
+    @classmethod
+    def _load_view(cls, view):
+        if view.view_id in cls.hibernated_views:
+            cls.wake_view(view)
+            return
+        found = cls.view_settings(view)
+        if view.view_id in cls.ignored_views:
+            # It kept the last color modes it had.
+            if not (found or (cls.color_modes, ""))[0]:
+                Loger.error(profile.error_color_modes_missing)
                 return
-        cls._paint_view(view, color_modes)
+            view_listener = cls.ignored_views.pop(view.view_id)
+            cls.painted_views[view.view_id] = view_listener
+            cls.start_painting(view_listener)
+            return
+
+        if found is not None:
+            cls._paint_view(view, *found)
 
     @classmethod
     def paint_view(cls, view):
@@ -332,37 +1437,151 @@ class ColorPainterViewsManager(sublime_plugin.EventListener):
     @classmethod
     def load_view(cls, view):
         # ignore views such as console, commands panel...
-        views = sublime.active_window().views()
-        if view.size() < 4 or view not in views:
+        window = view.window()
+        if view.size() < 4 or not window or view not in window.views():
+            return
+        # Huge views are only painted by the paint view command.
+        threshold = cls.on_demand_painting_threshold
+        if 0 < threshold < view.size():
             return
         if view.view_id not in cls.ignored_views:
             cls._load_view(view)
 
+    @classmethod
+    def visible_views(cls):
+        visible = set()
+        for window in sublime.windows():
+            for group in range(window.num_groups()):
+                view = window.active_view_in_group(group)
+                if view is not None:
+                    visible.add(view.view_id)
+        return visible
+
+    @classmethod
+    def is_cold(cls, view):
+        limit = cls.hibernation_limit
+        return (0 < limit <= len(cls.painted_views) and
+                view.view_id not in cls.visible_views())
+
+    @classmethod
+    def hibernate_cold(cls):
+        # Hibernate the views activated least recently beyond the limit,
+        # except those shown in a group.
+        limit = cls.hibernation_limit
+        if limit <= 0 or len(cls.painted_views) <= limit:
+            return
+        visible = cls.visible_views()
+        for view_id in list(cls.painted_views):
+            if len(cls.painted_views) <= limit:
+                break
+            if view_id in visible:
+                continue
+            view_listener = cls.painted_views.pop(view_id)
+            view_listener.hibernate()
+            cls.hibernated_views[view_id] = view_listener
+            cls.stats.count("hibernations", view_id)
+        cls.write_scheme()
+
+    @classmethod
+    def wake_view(cls, view):
+        view_listener = cls.hibernated_views.pop(view.view_id)
+        cls.painted_views[view.view_id] = view_listener
+        cls.stats.count("wakes", view.view_id)
+        source = cls.find_source(view_listener)
+        if source is None:
+            view_listener.wake()
+        else:
+            view_listener.follow(source)
+
+    @classmethod
+    def repaint_view(cls, view):
+        view_listener = cls.painted_views.pop(view.view_id, None)
+        if view_listener is None:
+            view_listener = cls.ignored_views.pop(view.view_id, None)
+        if view_listener is None:
+            view_listener = cls.hibernated_views.pop(view.view_id, None)
+        if view_listener is not None:
+            view_listener.unfollow()
+            view_listener.clear_all()
+        cls.load_view(view)
+
+    @classmethod
+    def repaint_all(cls):
+        # Views keep their colors until their turn comes.
+        cls.scheduler.schedule(sublime.windows())
+
     @classmethod
     def clear_view(cls, view):
-        if view.view_id in cls.painted_views:
-            view_listener = cls.painted_views.pop(view.view_id)
+        view_listener = cls.painted_views.pop(view.view_id, None)
+        if view_listener is None:
+            view_listener = cls.hibernated_views.pop(view.view_id, None)
+        if view_listener is not None:
+            view_listener.unfollow()
             view_listener.clear_all()
             cls.ignored_views[view.view_id] = view_listener
 
     @classmethod
     def clear_all(cls):
+        # Views still queued would be painted after the plugin is gone.
+        cls.scheduler.clear()
+        cls.painted_views.update(cls.hibernated_views)
         for view_listener in cls.painted_views.values():
+            view_listener.unfollow()
             view_listener.clear_all()
         cls.ignored_views = cls.painted_views
         cls.painted_views = {}
+        cls.hibernated_views = {}
 
     @classmethod
-    def clear_and_restart(cls):
-        for view_listener in cls.painted_views.values():
-            view_listener.clear_all()
-        for view_listener in cls.ignored_views.values():
-            view_listener.clear_all()
-        cls.painted_views = {}
-        cls.ignored_views = {}
-        for window in sublime.windows():
-            for view in window.views():
-                cls.load_view(view)
+    def update_views(cls):
+        # Apply changed settings to the views whose color modes or
+        # selector changed, leaving the others alone.
+        # Views painted by the paint view command keep being painted.
+        # Clones get the colors of their source.
+        for view_listener in list(cls.painted_views.values()):
+            found = cls.view_settings(view_listener.view)
+            color_modes, selector = found or (cls.color_modes, "")
+            if not color_modes:
+                # No color is looked for any more.
+                cls.clear_view(view_listener.view)
+                continue
+            if view_listener.source is view_listener:
+                view_listener.change_color_modes(color_modes, selector)
+            else:
+                view_listener.get_color_regexs(color_modes)
+                view_listener.selector = selector
+        # The others are painted from scratch when they are activated.
+        for view_listener in list(itertools.chain(
+                cls.ignored_views.values(), cls.hibernated_views.values())):
+            found = cls.view_settings(view_listener.view)
+            color_modes, selector = found or (cls.color_modes, "")
+            if color_modes:
+                view_listener.get_color_regexs(color_modes)
+            elif view_listener.view.view_id in cls.hibernated_views:
+                cls.clear_view(view_listener.view)
+            view_listener.selector = selector
+            view_listener.scoped_regions = None
+            view_listener.hibernated_change_count = None
+
+        # Views of the file types added are painted in turn, along with
+        # the views queued already.
+        queued = {view.view_id for view in cls.scheduler.queue}
+        cls.scheduler.schedule(sublime.windows(), lambda view: (
+            view.view_id in queued or
+            view.view_id not in cls.painted_views and
+            view.view_id not in cls.ignored_views and
+            view.view_id not in cls.hibernated_views))
+
+    @classmethod
+    def update_file_settings(cls, file_types, syntax_specific,
+                             scope_selectors):
+        if (file_types, syntax_specific, scope_selectors) == (
+                cls.file_types, cls.syntax_specific, cls.scope_selectors):
+            return
+        cls.file_types = file_types
+        cls.syntax_specific = syntax_specific
+        cls.scope_selectors = scope_selectors
+        cls.update_views()
 
     @classmethod
     def update_color_modes(cls, color_modes):
@@ -383,7 +1602,7 @@ class ColorPainterViewsManager(sublime_plugin.EventListener):
 
         if color_modes != cls.color_modes:
             cls.color_modes = color_modes
-            cls.clear_and_restart()
+            cls.update_views()
 
     @classmethod
     def update_gutter_icon(cls, gutter_icon):
@@ -397,38 +1616,35 @@ class ColorPainterViewsManager(sublime_plugin.EventListener):
             for view_listener in cls.painted_views.values():
                 view_listener.change_gutter_icon(gutter_icon)
 
+    @classmethod
+    def update_scan_cache(cls, scan_cache_size):
+        if scan_cache_size <= 0:
+            cls.scan_cache = None
+        elif cls.scan_cache is None:
+            dirname = profile._color_scheme_cache_dir(relative=False)
+            cls.scan_cache = ScanCache(dirname + "/scans", scan_cache_size)
+        else:
+            cls.scan_cache.max_size = scan_cache_size
+
     @classmethod
     def update_color_scheme(cls, color_scheme):
         if color_scheme == cls.color_scheme:
             return
-        cls.cswriter = ColorSchemeWriter(color_scheme)
-        cls.make_rule_full_text = cls.cswriter.make_rule(cls.style_full_text)
-        cls.make_rule_selection = cls.cswriter.make_rule(cls.style_selection)
+        # Each scheme keeps its writer, with its backgrounds and the
+        # colors it holds, for switching back to it.
+        if color_scheme not in cls.cswriters:
+            cls.cswriters[color_scheme] = ColorSchemeWriter(color_scheme)
+        cls.cswriter = cls.cswriters[color_scheme]
         cls.color_scheme = color_scheme
-
-        bg_full_text = cls.cswriter.bg_full_text
-        bg_selection = cls.cswriter.bg_selection
-        for view_listener in cls.painted_views.values():
-            view_listener.rebuild_scheme_rules(bg_full_text, bg_selection)
         cls.write_scheme()
 
     @classmethod
     def write_scheme(cls):
-        scheme_rules = []
-        for view_listener in cls.painted_views.values():
-            scheme_rules.extend(view_listener.scheme_rules_full_text)
-            scheme_rules.extend(view_listener.scheme_rules_selection)
-        if scheme_rules:
-            cls.cswriter.write_color_scheme(scheme_rules)
+        cls.cswriter.schedule_write()
 
     def on_load(self, view):
         ColorPainterViewsManager.load_view(view)
 
-    def on_modified(self, view):
-        if view.view_id in self.painted_views:
-            view_listener = self.painted_views[view.view_id]
-            view_listener.on_modified()
-
     def on_selection_modified(self, view):
         if view.view_id in self.painted_views:
             if self.style_selection == self.style_full_text:
@@ -437,22 +1653,47 @@ class ColorPainterViewsManager(sublime_plugin.EventListener):
             view_listener.on_selection_modified()
 
     def on_activated(self, view):
-        if view.view_id in self.painted_views:
-            view_listener = self.painted_views[view.view_id]
+        if self.scheduler.take(view):
+            self.repaint_view(view)
+        elif view.view_id in self.painted_views:
+            # Moved to the end, as the most recently activated.
+            view_listener = self.painted_views.pop(view.view_id)
+            self.painted_views[view.view_id] = view_listener
             view_listener.on_activated()
+        elif view.view_id in self.hibernated_views:
+            self.wake_view(view)
         else:
             self.on_load(view)
+        self.hibernate_cold()
 
     def on_post_save(self, view):
         self.on_activated(view)
 
     def on_close(self, view):
         if view.view_id in self.painted_views:
-            self.painted_views.pop(view.view_id)
+            view_listener = self.painted_views.pop(view.view_id)
+            view_listener.unfollow()
+            view_listener.clear_all()
+            self.stats.close(view.view_id)
+            self.write_scheme()
+        elif view.view_id in self.hibernated_views:
+            self.hibernated_views.pop(view.view_id)
+            self.stats.close(view.view_id)
         elif view.view_id in self.ignored_views:
             self.ignored_views.pop(view.view_id)
 
 
+class ColorPainterTextChangeListener(sublime_plugin.TextChangeListener):
+    def on_text_changed(self, changes):
+        painted_views = ColorPainterViewsManager.painted_views
+        for view in self.buffer.views():
+            if view.view_id in painted_views:
+                view_listener = painted_views[view.view_id]
+                # Clones are updated along with their source.
+                if view_listener.source is view_listener:
+                    view_listener.on_text_changed(changes)
+
+
 settings = {}
 preferences = {}
 
@@ -463,8 +1704,16 @@ def load_plugin(plugin):
         style_full_text = highlight_style.get("full_text", "text")
         style_selection = highlight_style.get("selection", "fill")
 
-        plugin.file_types = settings.get("file_types", [])
-        plugin.syntax_specific = settings.get("syntax_specific", {})
+        plugin.update_file_settings(
+            settings.get("file_types", []),
+            settings.get("syntax_specific", {}),
+            settings.get("scope_selectors", {}))
+        plugin.lazy_painting_threshold = settings.get(
+            "lazy_painting_threshold", 0)
+        plugin.on_demand_painting_threshold = settings.get(
+            "on_demand_painting_threshold", 0)
+        plugin.hibernation_limit = settings.get("hibernation_limit", 0)
+        plugin.update_scan_cache(settings.get("scan_cache_size", 0))
         plugin.style_full_text = profile.identify_style(style_full_text)
         plugin.style_selection = profile.identify_style(style_selection)
         plugin.update_color_modes(settings.get("color_modes", []))
@@ -490,8 +1739,7 @@ def plugin_loaded():
     os.makedirs(profile._color_scheme_cache_dir(relative=False), exist_ok=True)
 
     load_plugin(ColorPainterViewsManager)
-    view = sublime.active_window().active_view()
-    ColorPainterViewsManager.load_view(view)
+    ColorPainterViewsManager.repaint_all()
 
 def plugin_unloaded():
     settings.clear_on_change("highlight_style")
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+
+
+class ScanCache(object):
+    # Colors found in files, stored by file path, modification time, size,
+    # color modes and scope selector, so unchanged files need not be
+    # scanned again. The least recently used entries are removed beyond
+    # max_size bytes.
+    version = 2
+    # Smaller files are scanned faster than their entries are read.
+    min_size = 65536
+    extname = ".scan.json"
+
+    def __init__(self, dirname, max_size):
+        self.dirname = dirname
+        self.max_size = max_size
+
+    def key(self, path, color_modes, selector=""):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_size < self.min_size:
+            return None
+        return json.dumps([self.version, path, st.st_mtime, st.st_size,
+                           sorted(color_modes), selector])
+
+    def entry_path(self, key):
+        digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.dirname, digest + self.extname)
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+            # Mark it as recently used.
+            os.utime(path, None)
+        except (OSError, ValueError):
+            return None
+        if entry.get("key") != key:
+            return None
+
+        colors = entry["colors"]
+        table = entry["spans"]
+        spans = []
+        end = 0
+        for i in range(0, len(table), 3):
+            begin = end + table[i]
+            end = begin + table[i + 1]
+            spans.append((begin, end, colors[table[i + 2]]))
+        return spans
+
+    def put(self, key, spans):
+        # Each span is stored as its distance from the end of the previous
+        # one, its length and the index of its color. The table is written
+        # a batch at a time, so big files take little memory to store.
+        path = self.entry_path(key)
+        temppath = path + ".tmp"
+        try:
+            os.makedirs(self.dirname, exist_ok=True)
+            with open(temppath, "w", encoding="utf-8") as file:
+                file.write('{"key":%s,"spans":[' % json.dumps(key))
+                colors = self.write_table(file, spans)
+                file.write('],"colors":%s}' % json.dumps(colors))
+            os.replace(temppath, path)
+        except OSError:
+            return False
+        self.evict()
+        return True
+
+    def write_table(self, file, spans, batch_size=4096):
+        colors, numbers, table = [], {}, []
+        last = 0
+        sep = ""
+        for begin, end, color in spans:
+            if color not in numbers:
+                numbers[color] = len(colors)
+                colors.append(color)
+            table.extend((begin - last, end - begin, numbers[color]))
+            last = end
+            if len(table) >= batch_size * 3:
+                file.write(sep + ",".join(map(str, table)))
+                sep = ","
+                table = []
+        if table:
+            file.write(sep + ",".join(map(str, table)))
+        return colors
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.dirname):
+            if name.endswith(self.extname):
+                try:
+                    st = os.stat(os.path.join(self.dirname, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.dirname, name))
+            except OSError:
+                continue
+            total -= size
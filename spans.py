@@ -0,0 +1,304 @@
+import array
+import bisect
+import collections
+import itertools
+
+# Spans per block; a block is split past twice as many.
+BLOCK_SIZE = 512
+
+
+class Block(object):
+    # A run of spans, whose offsets are kept relative to the base.
+    __slots__ = ("base", "begins", "ends", "color_ids")
+
+    def __init__(self, base=0):
+        self.base = base
+        self.begins = array.array("q")
+        self.ends = array.array("q")
+        self.color_ids = array.array("I")
+
+    def first(self):
+        return self.begins[0] + self.base
+
+
+class ColorSpans(object):
+    # Colors of a view ordered by offset. Colors never overlap, so both
+    # begins and ends are sorted and can be searched with bisect. Offsets
+    # and color ids are kept in arrays, and each distinct color is kept
+    # once in the palette, which takes 20 bytes per color found.
+    # The arrays are cut in blocks, so an edit shifts the spans of its own
+    # block and only the bases of the blocks after it, and each color knows
+    # the blocks holding it, so its spans are found without the others.
+    __slots__ = ("blocks", "palette", "ids", "color_blocks")
+
+    def __init__(self):
+        self.clear()
+
+    def __len__(self):
+        return sum(len(blk.begins) for blk in self.blocks)
+
+    def __iter__(self):
+        getitem = self.palette.__getitem__
+        return itertools.chain.from_iterable(
+            zip(map(blk.base.__add__, blk.begins),
+                map(blk.base.__add__, blk.ends),
+                map(getitem, blk.color_ids))
+            for blk in self.blocks)
+
+    def clear(self):
+        # None of them is empty.
+        self.blocks = []
+        self.palette = []
+        # color -> index in the palette
+        self.ids = {}
+        # index in the palette -> {block: number of its spans of the color}
+        self.color_blocks = []
+
+    def copy(self):
+        spans = ColorSpans()
+        spans.palette = list(self.palette)
+        spans.ids = dict(self.ids)
+        spans.color_blocks = [{} for color in self.palette]
+        for blk in self.blocks:
+            copy = Block(blk.base)
+            copy.begins = blk.begins[:]
+            copy.ends = blk.ends[:]
+            copy.color_ids = blk.color_ids[:]
+            spans.blocks.append(copy)
+            spans.count(copy, copy.color_ids, 1)
+        return spans
+
+    def color_id(self, color):
+        i = self.ids.get(color)
+        if i is None:
+            i = self.ids[color] = len(self.palette)
+            self.palette.append(color)
+            self.color_blocks.append({})
+        return i
+
+    def counts(self):
+        # color -> number of its spans
+        return {self.palette[i]: sum(blocks.values())
+                for i, blocks in enumerate(self.color_blocks) if blocks}
+
+    def count(self, blk, color_ids, sign):
+        for i, n in collections.Counter(color_ids).items():
+            blocks = self.color_blocks[i]
+            n = blocks.get(blk, 0) + sign * n
+            if n:
+                blocks[blk] = n
+            else:
+                del blocks[blk]
+
+    def block_at(self, pt):
+        # Index of the last block beginning at or before pt, or 0.
+        blocks = self.blocks
+        lo, hi = 1, len(blocks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if blocks[mid].first() <= pt:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1
+
+    def find_all(self, points):
+        # The spans containing any of the sorted points.
+        found = []
+        if not self.blocks:
+            return found
+        for pt in points:
+            blk = self.blocks[self.block_at(pt)]
+            base = blk.base
+            i = bisect.bisect_right(blk.begins, pt - base) - 1
+            if i >= 0 and blk.ends[i] + base >= pt:
+                span = (blk.begins[i] + base, blk.ends[i] + base,
+                        self.palette[blk.color_ids[i]])
+                if not found or found[-1] != span:
+                    found.append(span)
+        return found
+
+    def find_range(self, begin, end):
+        # The spans which overlap or touch [begin, end].
+        found = []
+        b = max(0, self.block_at(begin) - 1)
+        for blk in itertools.islice(self.blocks, b, None):
+            base = blk.base
+            i = bisect.bisect_left(blk.ends, begin - base)
+            j = bisect.bisect_right(blk.begins, end - base, i)
+            found.extend(zip(map(base.__add__, blk.begins[i:j]),
+                             map(base.__add__, blk.ends[i:j]),
+                             map(self.palette.__getitem__,
+                                 blk.color_ids[i:j])))
+            if j < len(blk.begins):
+                break
+        return found
+
+    def group(self, colors):
+        # color -> (begin, end) of its spans, for each of the colors. Only
+        # the blocks holding them are walked.
+        wanted = {}
+        blocks = set()
+        for color in colors:
+            i = self.ids.get(color)
+            if i is not None:
+                wanted[i] = color
+                blocks.update(self.color_blocks[i])
+        groups = {color: [] for color in colors}
+        for blk in sorted(blocks, key=Block.first):
+            base = blk.base
+            for begin, end, i in zip(blk.begins, blk.ends, blk.color_ids):
+                if i in wanted:
+                    groups[wanted[i]].append((begin + base, end + base))
+        return groups
+
+    def cut(self, b, i, j):
+        # Remove the spans i to j of block b, and return them.
+        blk = self.blocks[b]
+        color_ids = blk.color_ids[i:j]
+        removed = list(zip(map(blk.base.__add__, blk.begins[i:j]),
+                           map(blk.base.__add__, blk.ends[i:j]),
+                           map(self.palette.__getitem__, color_ids)))
+        del blk.begins[i:j]
+        del blk.ends[i:j]
+        del blk.color_ids[i:j]
+        self.count(blk, color_ids, -1)
+        if not blk.begins:
+            del self.blocks[b]
+        return removed
+
+    def remove(self, begin, end):
+        # Remove the spans which overlap or touch [begin, end], and return
+        # them. The first one may end the block before.
+        removed = []
+        b = max(0, self.block_at(begin) - 1)
+        while b < len(self.blocks):
+            blk = self.blocks[b]
+            size = len(blk.begins)
+            i = bisect.bisect_left(blk.ends, begin - blk.base)
+            j = bisect.bisect_right(blk.begins, end - blk.base, i)
+            if i < j:
+                removed.extend(self.cut(b, i, j))
+            if j < size:
+                break
+            if blk.begins:
+                b += 1
+        return removed
+
+    def remove_all(self, indexes):
+        # Remove the spans at the sorted indexes, and return them.
+        removed = []
+        blocks = []
+        start = pos = 0
+        for blk in self.blocks:
+            size = len(blk.begins)
+            stop = bisect.bisect_left(indexes, start + size, pos)
+            if pos < stop:
+                keep = [True] * size
+                for i in indexes[pos:stop]:
+                    keep[i - start] = False
+                drop = [not k for k in keep]
+                compress = itertools.compress
+                color_ids = array.array("I", compress(blk.color_ids, drop))
+                removed.extend(zip(
+                    map(blk.base.__add__, compress(blk.begins, drop)),
+                    map(blk.base.__add__, compress(blk.ends, drop)),
+                    map(self.palette.__getitem__, color_ids)))
+                blk.begins = array.array("q", compress(blk.begins, keep))
+                blk.ends = array.array("q", compress(blk.ends, keep))
+                blk.color_ids = array.array("I",
+                                            compress(blk.color_ids, keep))
+                self.count(blk, color_ids, -1)
+                pos = stop
+            start += size
+            if blk.begins:
+                blocks.append(blk)
+        self.blocks = blocks
+        return removed
+
+    def shift(self, pt, delta):
+        # Move the spans beginning at or after pt by delta.
+        if not delta or not self.blocks:
+            return
+        b = self.block_at(pt)
+        blk = self.blocks[b]
+        i = bisect.bisect_left(blk.begins, pt - blk.base)
+        if i == 0:
+            blk.base += delta
+        elif i < len(blk.begins):
+            add = delta.__add__
+            blk.begins[i:] = array.array("q", map(add, blk.begins[i:]))
+            blk.ends[i:] = array.array("q", map(add, blk.ends[i:]))
+        for blk in itertools.islice(self.blocks, b + 1, None):
+            blk.base += delta
+
+    def gap(self, begin, end):
+        # (block, index) where spans within [begin, end] go, or None if
+        # it overlaps a span.
+        blocks = self.blocks
+        if not blocks:
+            return 0, 0
+        b = self.block_at(begin)
+        blk = blocks[b]
+        i = bisect.bisect_left(blk.begins, begin - blk.base)
+        if i > 0:
+            if blk.ends[i - 1] + blk.base > begin:
+                return None
+        elif b > 0:
+            if blocks[b - 1].ends[-1] + blocks[b - 1].base > begin:
+                return None
+        if i < len(blk.begins):
+            if blk.begins[i] + blk.base < end:
+                return None
+        elif b + 1 < len(blocks):
+            if blocks[b + 1].first() < end:
+                return None
+        return b, i
+
+    def splice(self, b, i, spans):
+        if not self.blocks:
+            self.blocks.append(Block())
+        blk = self.blocks[b]
+        base = blk.base
+        color_ids = array.array("I", [self.color_id(s[2]) for s in spans])
+        blk.begins[i:i] = array.array("q", [s[0] - base for s in spans])
+        blk.ends[i:i] = array.array("q", [s[1] - base for s in spans])
+        blk.color_ids[i:i] = color_ids
+        self.count(blk, color_ids, 1)
+        size = len(blk.begins)
+        if size > 2 * BLOCK_SIZE:
+            # In even pieces of about BLOCK_SIZE spans.
+            n = size // BLOCK_SIZE
+            cuts = [size * k // n for k in range(1, n + 1)]
+            pieces = []
+            for start, stop in zip(cuts, cuts[1:]):
+                piece = Block(base)
+                piece.begins = blk.begins[start:stop]
+                piece.ends = blk.ends[start:stop]
+                piece.color_ids = blk.color_ids[start:stop]
+                self.count(piece, piece.color_ids, 1)
+                pieces.append(piece)
+            self.count(blk, blk.color_ids[cuts[0]:], -1)
+            del blk.begins[cuts[0]:]
+            del blk.ends[cuts[0]:]
+            del blk.color_ids[cuts[0]:]
+            self.blocks[b + 1:b + 1] = pieces
+
+    def insert(self, spans):
+        # spans: sorted (begin, end, color) tuples. Those overlapping a span
+        # already indexed are dropped, and the others are returned.
+        if not spans:
+            return spans
+        at = self.gap(spans[0][0], spans[-1][1])
+        if at is not None:
+            # The common case: all of them fit in one gap.
+            self.splice(at[0], at[1], spans)
+            return spans
+
+        inserted = []
+        for span in spans:
+            at = self.gap(span[0], span[1])
+            if at is not None:
+                self.splice(at[0], at[1], [span])
+                inserted.append(span)
+        return inserted
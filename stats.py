@@ -0,0 +1,144 @@
+import collections
+import threading
+import time
+
+
+class Histogram(object):
+    # Upper bounds of the buckets, in milliseconds.
+    bounds = (0.1, 0.5, 1, 5, 10, 50, 100, 500, float("inf"))
+
+    def __init__(self):
+        self.buckets = [0] * len(self.bounds)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        i = 0
+        while ms > self.bounds[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def render(self, width=40):
+        lines = []
+        most = max(self.buckets) or 1
+        lower = 0
+        for bound, n in zip(self.bounds, self.buckets):
+            if n:
+                if bound == float("inf"):
+                    label = ">{:g}ms".format(lower)
+                else:
+                    label = "{:g}-{:g}ms".format(lower, bound)
+                bar = "#" * max(1, n * width // most)
+                lines.append("  {:>13} {:>7} {}".format(label, n, bar))
+            lower = bound
+        return lines
+
+
+class ViewStats(object):
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+        self.counters = collections.Counter()
+        self.phases = collections.Counter()
+        # Phases may run inside each other, such as a flush inside a
+        # selection change, so only the outermost ones add to the total.
+        self.total = 0.0
+
+
+class Timer(object):
+    def __init__(self, stats, phase, view_id):
+        self.stats = stats
+        self.phase = phase
+        self.view_id = view_id
+
+    def __enter__(self):
+        local = self.stats.local
+        depth = getattr(local, "depth", 0)
+        self.outermost = not depth
+        local.depth = depth + 1
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        ms = (time.perf_counter() - self.start) * 1000
+        self.stats.local.depth -= 1
+        self.stats.record(self.phase, self.view_id, ms, self.outermost)
+
+
+class Stats(object):
+    # Timings of the hot paths and counters of the work they do, in total
+    # and per view. View id None stands for work shared by all views, such
+    # as writing the color scheme.
+    def __init__(self):
+        # The depth of nested phases, per thread, as the async worker
+        # scans while the main thread applies and flushes.
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        self.since = time.time()
+        self.phases = collections.defaultdict(Histogram)
+        self.counters = collections.Counter()
+        self.views = {}
+
+    def view(self, view_id, name):
+        if view_id not in self.views:
+            self.views[view_id] = ViewStats(name)
+        self.views[view_id].closed = False
+
+    def close(self, view_id):
+        if view_id in self.views:
+            self.views[view_id].closed = True
+
+    def timer(self, phase, view_id=None):
+        return Timer(self, phase, view_id)
+
+    def record(self, phase, view_id, ms, outermost=True):
+        self.phases[phase].add(ms)
+        if view_id in self.views:
+            vs = self.views[view_id]
+            vs.phases[phase] += ms
+            if outermost:
+                vs.total += ms
+
+    def count(self, counter, view_id=None, n=1):
+        self.counters[counter] += n
+        if view_id in self.views:
+            self.views[view_id].counters[counter] += n
+
+    def report(self, slowest=10):
+        lines = ["ColorPainter stats since {}".format(
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.since)))]
+
+        lines.append("")
+        lines.append("Phases:")
+        for phase in sorted(self.phases):
+            h = self.phases[phase]
+            lines.append(
+                "{} calls={} total={:.1f}ms mean={:.3f}ms max={:.1f}ms".format(
+                    phase, h.count, h.total, h.total / h.count, h.max))
+            lines.extend(h.render())
+
+        lines.append("")
+        lines.append("Counters:")
+        for counter in sorted(self.counters):
+            lines.append("  {:<20} {}".format(counter, self.counters[counter]))
+
+        views = sorted(self.views.values(), key=lambda vs: vs.total,
+                       reverse=True)
+        lines.append("")
+        lines.append("Slowest views:")
+        for vs in views[:slowest]:
+            name = vs.name + (" (closed)" if vs.closed else "")
+            lines.append("{:.1f}ms {}".format(vs.total, name))
+            phases = ", ".join("{} {:.1f}ms".format(p, vs.phases[p])
+                               for p in sorted(vs.phases))
+            counters = ", ".join("{} {}".format(c, vs.counters[c])
+                                 for c in sorted(vs.counters))
+            lines.append("  " + phases)
+            lines.append("  " + counters)
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,13 @@
+import sys
+import types
+
+PACKAGE = "ColorPainter"
+
+
+def register_package(root, name=PACKAGE):
+    # Make the plugin importable as a package without putting its modules,
+    # such as profile.py, on sys.path.
+    pkg = types.ModuleType(name)
+    pkg.__path__ = [root]
+    pkg.__package__ = name
+    sys.modules[name] = pkg
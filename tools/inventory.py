@@ -0,0 +1,221 @@
+"""Headless inventory of the colors in a tree of files.
+
+    python tools/inventory.py PATH... [--format json|csv] [--output FILE]
+                              [--settings FILE] [--jobs N]
+
+Files are chosen and scanned the way the plugin paints views: by the
+file_types, color_modes and syntax_specific settings, with the same
+regular expressions, and every color is reported with its file, line,
+column (both from 1) and canonical value. The scope_selectors setting is
+not applied, since it needs the syntax definitions of sublime_text.
+"""
+import argparse
+import csv
+import importlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+
+from common import PACKAGE, register_package
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+register_package(ROOT)
+
+matcher = importlib.import_module(PACKAGE + ".matcher")
+colors = importlib.import_module(PACKAGE + ".colors")
+
+
+def load_settings(path):
+    # sublime settings are JSON with comments and trailing commas.
+    with open(path, "r", encoding="utf-8") as file:
+        text = file.read()
+    text = re.sub(r"^\s*//.*$", "", text, flags=re.M)
+    text = re.sub(r",(\s*[}\]])", r"\1", text)
+    return json.loads(text)
+
+
+def color_modes_of(path, settings):
+    # The color modes the plugin would paint the file with, or None if it
+    # would not paint it.
+    color_modes = settings.get("color_modes", [])
+    ext = os.path.splitext(path)[1].lstrip(".")
+    syntax_specific = settings.get("syntax_specific", {})
+    if ext in syntax_specific:
+        rmv = syntax_specific[ext]
+        return [cm for cm in color_modes if cm not in rmv]
+    if ext in settings.get("file_types", []):
+        return color_modes
+    return None
+
+
+def find_files(paths, settings):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                filename = os.path.join(dirpath, name)
+                if color_modes_of(filename, settings) is not None:
+                    yield filename
+
+
+def scan_text(file, regex, chunk_size):
+    # Yields (line, column, text) of the colors in a file read chunk_size
+    # characters at a time. Chunks end at a newline, and each one is
+    # scanned with MAX_COLOR_LENGTH characters of the next, like the views
+    # of the plugin, so colors cut by a chunk boundary are still found.
+    margin = matcher.MAX_COLOR_LENGTH
+    text = ""
+    # offset in the file of text[0], and of the line being scanned
+    base = 0
+    line, line_start = 1, 0
+    begin = 0
+    eof = False
+    while True:
+        while not eof and len(text) - begin < chunk_size + margin:
+            data = file.read(chunk_size)
+            eof = not data
+            text += data
+        if begin >= len(text):
+            return
+        stop = min(begin + chunk_size, len(text))
+        if stop < len(text):
+            cut = text.rfind("\n", begin, stop)
+            if cut >= 0:
+                stop = cut + 1
+        pos = begin
+        for match in regex.finditer(text, begin, stop + margin):
+            start = match.start()
+            if start >= stop:
+                break
+            newlines = text.count("\n", pos, start)
+            if newlines:
+                line += newlines
+                line_start = base + text.rfind("\n", pos, start) + 1
+            pos = start
+            yield line, base + start - line_start + 1, match.group()
+        newlines = text.count("\n", pos, stop)
+        if newlines:
+            line += newlines
+            line_start = base + text.rfind("\n", pos, stop) + 1
+        # Keep a character before the next chunk for \b.
+        drop = max(0, stop - 1)
+        text = text[drop:]
+        base += drop
+        begin = stop - drop
+
+
+def scan_file(job):
+    path, color_modes, chunk_size = job
+    regex = matcher.ColorMatcher.get(color_modes)
+    found = []
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as file:
+            for line, column, text in scan_text(file, regex, chunk_size):
+                found.append((line, column, colors.normalize(text), text))
+    except OSError as e:
+        return path, found, str(e)
+    return path, found, None
+
+
+class JsonWriter(object):
+    def __init__(self, file):
+        self.file = file
+        self.first = True
+        self.file.write("[")
+
+    def write(self, path, line, column, value, text):
+        self.file.write("\n" if self.first else ",\n")
+        self.first = False
+        self.file.write(json.dumps({
+            "file": path, "line": line, "column": column,
+            "value": value, "text": text}))
+
+    def close(self):
+        self.file.write("\n]\n")
+
+
+class CsvWriter(object):
+    def __init__(self, file):
+        self.writer = csv.writer(file)
+        self.writer.writerow(["file", "line", "column", "value", "text"])
+
+    def write(self, path, line, column, value, text):
+        self.writer.writerow([path, line, column, value, text])
+
+    def close(self):
+        pass
+
+
+writers = {
+    "json": JsonWriter,
+    "csv": CsvWriter,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="List the colors in files as ColorPainter finds them.")
+    parser.add_argument("paths", nargs="+", metavar="PATH")
+    parser.add_argument("--format", choices=sorted(writers), default="json")
+    parser.add_argument("--output", default="-",
+                        help="file to write to, standard output by default")
+    parser.add_argument(
+        "--settings",
+        default=os.path.join(ROOT, "ColorPainter.sublime-settings"),
+        help="settings to choose files and color modes by")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of processes scanning files")
+    parser.add_argument("--chunk-size", type=int, default=1 << 20,
+                        help="characters read from a file at a time")
+    args = parser.parse_args(argv)
+
+    settings = load_settings(args.settings)
+    failed = 0
+    for path in args.paths:
+        try:
+            os.stat(path)
+        except OSError as e:
+            print("{}: {}".format(path, e.strerror), file=sys.stderr)
+            failed += 1
+    jobs = []
+    for path in find_files(args.paths, settings):
+        color_modes = color_modes_of(path, settings)
+        if color_modes is None:
+            color_modes = settings.get("color_modes", [])
+        if not set(color_modes) & set(matcher.color_regexs):
+            # Not painted, as no color is looked for.
+            continue
+        jobs.append((path, color_modes, args.chunk_size))
+
+    if args.output == "-":
+        output = sys.stdout
+    else:
+        output = open(args.output, "w", encoding="utf-8", newline="")
+    writer = writers[args.format](output)
+    pool = multiprocessing.Pool(max(1, args.jobs))
+    try:
+        # In the order of the files, while later ones are being scanned.
+        for path, found, error in pool.imap(scan_file, jobs, chunksize=4):
+            if error is not None:
+                print("{}: {}".format(path, error), file=sys.stderr)
+                failed += 1
+            for line, column, value, text in found:
+                writer.write(path, line, column, value, text)
+        writer.close()
+    finally:
+        pool.close()
+        pool.join()
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())